@@ -1,28 +1,349 @@
+import argparse
+import hashlib
+import math
+import os
+import re
+import sys
+import time
 import turtle
 
+import cv2
+import numpy as np
+
+
+# Production table of an L-system for parallel rewriting. Every symbol, i.e. a predecessor of a rule or
+# a single character, gets a code, and a generation is rewritten in one pass by replacing every code
+# with the codes of its successor. The string is split into symbols once, so symbols are rewritten as
+# tokens: a predecessor that would only appear across the successors of two symbols is not matched,
+# and validate rejects the rule sets where this can happen
+class Productions:
+    def __init__(self, rules):
+        # Predecessors are matched longest first, any other character is a symbol of its own
+        predecessors = sorted(rules, key=len, reverse=True)
+        self._pattern = re.compile("".join(re.escape(key) + "|" for key in predecessors) + ".", re.DOTALL)
+        self.rules = rules
+        self.symbols = []
+        self._codes = {}
+        self._successors = {key: self.encode(value) for key, value in rules.items()}
+        self._tables = None
+        self._expansions = None
+
+    def encode(self, text):
+        codes = []
+        for symbol in self._pattern.findall(text):
+            if symbol not in self._codes:
+                self._codes[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+                self._tables = None
+            codes.append(self._codes[symbol])
+
+        self._expansions = None
+        return np.array(codes, np.uint32)
+
+    # Raises ValueError if a predecessor can be read across two neighbouring symbols of the codes or of any
+    # of their generations, e.g. "FX" in "F" + "X..." with the rules ("A", "F"), ("FX", "Y") and the axiom "AX".
+    # The pairs of symbols that can be neighbours are collected until no generation adds a new one
+    def validate(self, codes):
+        if all(len(key) == 1 for key in self.rules) or len(codes) == 0:
+            return
+
+        expansions = [expansion if expansion is not None else [code]
+                      for code, expansion in enumerate(self.expansions())]
+        count = len(self.symbols)
+        wide = codes.astype(np.int64)
+        pairs = {divmod(pair, count) for pair in np.unique(wide[:-1] * count + wide[1:]).tolist()}
+        reached = set(np.unique(codes).tolist())
+        size = None
+        while size != (len(reached), len(pairs)):
+            size = (len(reached), len(pairs))
+            for code in list(reached):
+                reached.update(expansions[code])
+                pairs.update(zip(expansions[code], expansions[code][1:]))
+            # A symbol rewritten to nothing leaves its neighbours next to each other
+            pairs.update((left, right) for left, middle in list(pairs) if not expansions[middle]
+                         for other, right in list(pairs) if other == middle)
+            pairs.update((expansions[left][-1], expansions[right][0]) for left, right in list(pairs)
+                         if expansions[left] and expansions[right])
+
+        following = {}
+        for left, right in pairs:
+            following.setdefault(left, set()).add(right)
+
+        # The rest of the predecessor after the text of the symbol must not be spelled by the symbols after it
+        def spelled(rest, code):
+            for right in following.get(code, ()):
+                text = self.symbols[right]
+                if text.startswith(rest) or rest.startswith(text) and spelled(rest[len(text):], right):
+                    return True
+            return False
+
+        for code in reached:
+            text = self.symbols[code]
+            for key in self.rules:
+                if len(key) > len(text) and key.startswith(text) and spelled(key[len(text):], code):
+                    raise ValueError(f'The predecessor "{key}" can appear across the symbol "{text}" and the symbols '
+                                     f'after it, which are rewritten separately')
+
+    # Code of a symbol of the table, None for a symbol that is not in it
+    def code(self, symbol):
+        return self._codes.get(symbol)
+
+    # Successor codes of every code as lists, None for the symbols without a rule, which are never rewritten
+    def expansions(self):
+        if self._expansions is None:
+            self._expansions = [self._successors[symbol].tolist() if symbol in self._successors else None
+                                for symbol in self.symbols]
+
+        return self._expansions
+
+    def rewrite(self, codes):
+        return _gather(*self._build()[0], codes)
+
+    def decode(self, codes):
+        return self.characters(codes).tobytes().decode("latin-1")
+
+    # Characters of the symbols of the codes as a uint8 array
+    def characters(self, codes):
+        return _gather(*self._build()[1], codes)
+
+    def _build(self):
+        # Successors of all codes and characters of all symbols as rows of padded tables
+        if self._tables is None:
+            successors = [self._successors.get(symbol, [code]) for code, symbol in enumerate(self.symbols)]
+            chars = [symbol.encode("latin-1") for symbol in self.symbols]
+            code_type = np.uint8 if len(self.symbols) < 255 else np.uint32
+            # A character that does not occur in the symbols pads the rows of the table of characters
+            char_padding = min(set(range(256)) - set(b"".join(chars)))
+            self._tables = (_pad(successors, len(self.symbols), code_type), _pad(chars, char_padding, np.uint8))
+
+        return self._tables
+
+
+def _pad(rows, padding, dtype):
+    table = np.full((len(rows), max(map(len, rows), default=1)), padding, dtype)
+    for i, row in enumerate(rows):
+        table[i, :len(row)] = list(row)
+
+    return table, padding
+
+
+# Concatenates the rows of the table for all codes, dropping the padding, without a Python loop
+def _gather(table, padding, codes):
+    symbols = np.take(table, codes.astype(table.dtype, copy=False), axis=0).ravel()
+    return symbols[symbols != padding]
+
+
+# Geometry of a single move in the format of LSystem2D.geometry
+def _move_geometry(move, angle):
+    if move == "F":
+        return 1.0, 0.0, 0.0, True
+    if move == "S":
+        return 1.0, 0.0, 0.0, False
+    if move == "+":
+        return 0.0, 0.0, angle, False
+    if move == "-":
+        return 0.0, 0.0, -angle, False
+    if move in "[]":
+        return None
+    return 0.0, 0.0, 0.0, False
+
+
+# Cache of generated states and their segments in .npy files in a directory. A state is rewritten from
+# the latest cached generation before it, and the least recently used files are deleted when the files
+# take more than max_bytes
+class GeometryCache:
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    # Codes of the state of the system after n_iter generations from the axiom
+    def codes(self, l_sys, n_iter):
+        generation = n_iter
+        while generation > 0 and not os.path.exists(self._path("codes", l_sys, generation)):
+            generation -= 1
+        if generation:
+            codes = self._load(self._path("codes", l_sys, generation))
+        else:
+            codes = l_sys._productions.encode(l_sys.axiom)
+
+        while generation < n_iter:
+            codes = l_sys._productions.rewrite(codes)
+            generation += 1
+            codes = self._save(self._path("codes", l_sys, generation), codes)
+        return codes
+
+    # Segments of the system after n_iter generations drawn from (0, 0) at the angle 0
+    def segments(self, l_sys, n_iter):
+        path = self._path("segments", l_sys, n_iter)
+        if os.path.exists(path):
+            return self._load(path)
+        return self._save(path, l_sys._segments((0, 0), 0))
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy"):
+                os.remove(os.path.join(self.directory, name))
+
+    # The codes depend on the order of the rules, which numbers the symbols; the segments also
+    # on the angle and the length
+    def _path(self, kind, l_sys, n_iter):
+        key = (kind, l_sys.axiom, list(l_sys.rules.items()), n_iter)
+        if kind == "segments":
+            key += (float(l_sys.angle), float(l_sys.length))
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{kind}-{digest}.npy")
+
+    @staticmethod
+    def _load(path):
+        # The access time is kept in the modification time, which the eviction uses
+        os.utime(path)
+        return np.load(path, mmap_mode="r")
+
+    def _save(self, path, data):
+        # Written to a temporary file first so that other processes never load a partial file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, data)
+        os.replace(temporary, path)
+        self._evict(path)
+        return data
+
+    def _evict(self, keep):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".npy") and path != keep:
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files) + os.path.getsize(keep)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
 
 class LSystem2D:
-    def __init__(self, axiom, width, length, angle):
+    def __init__(self, axiom, width, length, angle, cache=None):
         self.axiom = axiom
         self.state = axiom
         self.width = width
         self.length = length
         self.angle = angle
         self.rules = {}
-        self.t = turtle.Turtle()
-        self.t.ht()
-        self.t.pensize(self.width)
+        self.cache = cache
+        # Number of generations from the axiom, None if the state was set otherwise
+        self._generation = 0
+        self._productions = None
+        self._geometry = {}
+        # The turtle opens a window, so it is created only when the system is drawn with it
+        self.t = None
+
+    @property
+    def state(self):
+        if self._state is None:
+            self._state = self._productions.decode(self._codes)
+        return self._state
+
+    @state.setter
+    def state(self, value):
+        self._state = value
+        self._codes = None
+        self._generation = None
 
     def add_rules(self, *rules):
+        # The current state is kept as a string and encoded again with the new rules
+        generation = self._generation
+        self.state = self.state
+        self._generation = 0 if generation == 0 else None
         for key, value in rules:
             self.rules[key] = value
+        self._productions = None
 
     def generate_path(self, n_iter):
-        for n in range(n_iter):
-            for key, value in self.rules.items():
-                self.state = self.state.replace(key, value.lower())
-
-            self.state = self.state.upper()
+        self._encode()
+        if self.cache is not None and self._generation is not None:
+            self._generation += n_iter
+            self._codes = self.cache.codes(self, self._generation)
+        else:
+            for n in range(n_iter):
+                self._codes = self._productions.rewrite(self._codes)
+        self._state = None
+
+    # Yields the moves of the state after n_iter more generations one by one, walking the tree of productions
+    # depth first, so that memory grows with n_iter rather than with the length of the state.
+    # With bulk=True a subtree without branches that draws nothing is yielded as one jump (dx, dy, turn):
+    # the displacement in the frame of the turtle and the change of its heading
+    def expand(self, n_iter, bulk=False):
+        codes = self._encode()
+        expansions = self._productions.expansions()
+        symbols = self._productions.symbols
+
+        stack = [(iter(codes.tolist()), n_iter)]
+        while stack:
+            code = next(stack[-1][0], None)
+            if code is None:
+                stack.pop()
+                continue
+
+            depth = stack[-1][1]
+            if depth == 0 or expansions[code] is None:
+                yield from symbols[code]
+                continue
+
+            if bulk:
+                geometry = self.geometry(symbols[code], depth)
+                if geometry is not None and not geometry[3]:
+                    yield geometry[0] * self.length, geometry[1] * self.length, geometry[2]
+                    continue
+
+            stack.append((iter(expansions[code]), depth - 1))
+
+    # Displacement (dx, dy) in units of length and change of heading of the turtle drawing the expansion of
+    # the symbol after depth generations, starting at the origin with heading 0, and whether it draws anything.
+    # None if the expansion has branches.
+    # The results are memoized for every symbol and depth, so a deep expansion costs O(depth) calls
+    def geometry(self, symbol, depth):
+        self._encode()
+        key = (symbol, depth, self.angle)
+        if key in self._geometry:
+            return self._geometry[key]
+
+        code = self._productions.code(symbol)
+        expansion = self._productions.expansions()[code] if code is not None else None
+        if depth == 0 or expansion is None:
+            parts = [_move_geometry(move, self.angle) for move in symbol]
+        else:
+            parts = [self.geometry(self._productions.symbols[code], depth - 1) for code in expansion]
+
+        geometry = None
+        if None not in parts:
+            x = y = heading = 0.0
+            drawn = False
+            for dx, dy, turn, part_drawn in parts:
+                cos, sin = math.cos(math.radians(heading)), math.sin(math.radians(heading))
+                x, y = x + cos * dx - sin * dy, y + sin * dx + cos * dy
+                heading += turn
+                drawn = drawn or part_drawn
+            geometry = (x, y, heading, drawn)
+
+        self._geometry[key] = geometry
+        return geometry
+
+    def _encode(self):
+        if self._productions is None:
+            self._productions = Productions(dict(self.rules))
+            self._geometry = {}
+        if self._codes is None:
+            self._codes = self._productions.encode(self.state)
+            self._productions.validate(self._codes)
+
+        return self._codes
 
     def set_turtle(self, my_tuple):
         self.t.up()
@@ -30,133 +351,342 @@ class LSystem2D:
         self.t.seth(my_tuple[2])
         self.t.down()
 
+    # Interprets the state as a turtle would, for all moves at once, and returns the drawn line segments.
+    # Headings are the cumulative sum of the turns and positions the cumulative sum of the steps. A "]" gets
+    # the turn and the step that bring the turtle back to where it was at the matching "[", so the stack
+    # of the turtle is handled without a loop over the moves
+    def segments(self, start_pos=(0, 0), start_angle=0):
+        """
+
+        :return: float32 array N x 4 of segments (x1, y1, x2, y2) and float32 array of their pen widths
+        """
+        if self.cache is None or self._generation is None:
+            segments = self._segments(start_pos, start_angle)
+        else:
+            segments = _place(self.cache.segments(self, self._generation), start_pos, start_angle)
+
+        # No move changes the pen width, so the width restored at "]" is the same as the saved one
+        return segments, np.full(len(segments), self.width, np.float32)
+
+    def _segments(self, start_pos, start_angle):
+        chars = self._productions.characters(self._encode()) if self._state is None else \
+            np.frombuffer(self._state.encode("latin-1"), np.uint8)
+        # Symbols that do not move the turtle are dropped
+        moves = _MOVE_KINDS[chars]
+        moves = moves[moves < len(_MOVES)]
+        # Brackets left open are closed after the last move, as the turtle never returns to the saved states
+        unclosed = np.count_nonzero(moves == _MOVES.index(b"[")) - np.count_nonzero(moves == _MOVES.index(b"]"))
+        if unclosed > 0:
+            moves = np.concatenate((moves, np.full(unclosed, _MOVES.index(b"]"), np.uint8)))
+
+        turns = np.array([0.0, 0.0, self.angle, -self.angle, 0.0, 0.0])[moves]
+        groups, closes = _brackets(moves)
+
+        # Every move inside brackets belongs to the innermost pair. The sum of the turns and the steps of
+        # a pair is undone at its "]"; the moves of the nested pairs are undone by their own "]"
+        inside = groups >= 0
+        turns[closes] = -np.bincount(groups[inside], turns[inside], len(closes))
+        headings = np.radians(start_angle + np.cumsum(turns))
+
+        stepped = np.flatnonzero(moves <= _MOVES.index(b"S"))
+        dx, dy = np.zeros(len(moves)), np.zeros(len(moves))
+        dx[stepped] = self.length * np.cos(headings[stepped])
+        dy[stepped] = self.length * np.sin(headings[stepped])
+        dx[closes] = -np.bincount(groups[inside], dx[inside], len(closes))
+        dy[closes] = -np.bincount(groups[inside], dy[inside], len(closes))
+        x, y = start_pos[0] + np.cumsum(dx), start_pos[1] + np.cumsum(dy)
+
+        drawn = np.flatnonzero(moves == _MOVES.index(b"F"))
+        segments = np.stack((x[drawn] - dx[drawn], y[drawn] - dy[drawn], x[drawn], y[drawn]), axis=1)
+        return segments.astype(np.float32)
+
     def draw_turtle(self, start_pos, start_angle):
-        turtle.tracer(1, 0)
-        self.t.up()
-        self.t.setpos(start_pos)
-        self.t.seth(start_angle)
-        self.t.down()
-        turtle_stack = []
-
-        for move in self.state:
-            if move == "F":
-                self.t.forward(self.length)
-            elif move == "S":
-                self.t.up()
-                self.t.forward(self.length)
-                self.t.down()
-            elif move == "+":
-                self.t.left(self.angle)
-            elif move == "-":
-                self.t.right(self.angle)
-            elif move == "[":
-                turtle_stack.append((self.t.xcor(), self.t.ycor(), self.t.heading(), self.t.pensize()))
-            elif move == "]":
-                xcor, ycor, head, w = turtle_stack.pop()
-                self.set_turtle((xcor, ycor, head))
-                self.width = w
-                self.t.pensize(self.width)
+        segments, widths = self.segments(start_pos, start_angle)
 
-        turtle.done()
+        if self.t is None:
+            self.t = turtle.Turtle()
+            self.t.ht()
+        turtle.tracer(0, 0)
+
+        for width, path in _paths(segments, widths):
+            self.t.pensize(width)
+            self.set_turtle((path[0, 0], path[0, 1], self.t.heading()))
+            for x, y in path[1:].tolist():
+                self.t.goto(x, y)
 
+        turtle.update()
+        turtle.done()
 
-def draw_snowflake():
+    # Draws the system without the turtle on an image scaled to fit size = (width, height),
+    # or at one pixel per turtle step if size is None
+    def render(self, start_pos=(0, 0), start_angle=0, size=None, margin=10):
+        """
+
+        :return: grayscale image, black lines on white
+        """
+        segments, widths = self.segments(start_pos, start_angle)
+        segments, shape = _fit(segments, size, margin)
+
+        canvas = np.full(shape, 255, np.uint8)
+        runs = {}
+        for width, path in _paths(segments, widths):
+            runs.setdefault(width, []).append(np.rint(path * (1 << _SUBPIXEL_BITS)).astype(np.int32))
+        # One call per pen width, coordinates with a fractional part of _SUBPIXEL_BITS bits
+        for width, paths in runs.items():
+            cv2.polylines(canvas, paths, False, 0, max(1, round(width)), cv2.LINE_AA, _SUBPIXEL_BITS)
+
+        return canvas
+
+    # Writes the system as SVG: a path per pen width with relative moves between integer coordinates
+    # in tenths of a pixel
+    def write_svg(self, file_name, start_pos=(0, 0), start_angle=0, size=None, margin=10):
+        segments, widths = self.segments(start_pos, start_angle)
+        segments, (height, width) = _fit(segments, size, margin)
+
+        runs = {}
+        for pen_width, path in _paths(segments, widths):
+            points = np.rint(path * 10).astype(np.int64)
+            deltas = np.diff(points, axis=0).ravel()
+            runs.setdefault(pen_width, []).append(
+                f"M{points[0, 0]} {points[0, 1]}l" + " ".join(map(str, deltas.tolist())).replace(" -", "-"))
+
+        with open(file_name, "w") as file:
+            file.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+                       f'viewBox="0 0 {width * 10} {height * 10}">\n'
+                       f'<rect width="100%" height="100%" fill="white"/>\n')
+            for pen_width, paths in runs.items():
+                file.write(f'<path fill="none" stroke="black" stroke-width="{pen_width * 10:g}" '
+                           f'stroke-linecap="round" stroke-linejoin="round" d="{"".join(paths)}"/>\n')
+            file.write("</svg>\n")
+
+    # Draws with the turtle, or into the file if one is given: SVG for .svg, an image for other extensions
+    def draw(self, start_pos, start_angle, file_name=None, size=None):
+        if file_name is None:
+            self.draw_turtle(start_pos, start_angle)
+        elif file_name.lower().endswith(".svg"):
+            self.write_svg(file_name, start_pos, start_angle, size)
+        else:
+            cv2.imwrite(file_name, self.render(start_pos, start_angle, size))
+
+
+# Rotates the segments drawn from (0, 0) at the angle 0 to start_angle and moves them to start_pos
+def _place(segments, start_pos, start_angle):
+    if tuple(start_pos) == (0, 0) and start_angle == 0:
+        return segments
+    cos, sin = math.cos(math.radians(start_angle)), math.sin(math.radians(start_angle))
+    points = np.asarray(segments, np.float64).reshape(-1, 2)
+    placed = points @ np.array([[cos, sin], [-sin, cos]]) + start_pos
+    return placed.reshape(-1, 4).astype(np.float32)
+
+
+# Splits the segments into paths of consecutive segments with the same pen width
+def _paths(segments, widths):
+    breaks = np.flatnonzero(np.any(segments[1:, :2] != segments[:-1, 2:], axis=1) | (widths[1:] != widths[:-1])) + 1
+    for start, stop in zip(np.r_[0, breaks], np.r_[breaks, len(segments)]):
+        if start < stop:
+            yield float(widths[start]), np.vstack((segments[start, :2], segments[start:stop, 2:]))
+
+
+# Moves the segments from turtle coordinates (y up) to image coordinates (y down) fitting them into
+# size = (width, height) with the margin, and returns them with the shape of the image
+def _fit(segments, size, margin):
+    if not len(segments):
+        return segments, (2 * margin, 2 * margin) if size is None else (size[1], size[0])
+
+    points = segments.reshape(-1, 2)
+    low, high = points.min(axis=0), points.max(axis=0)
+    extent = np.maximum(high - low, 1e-9)
+    if size is None:
+        scale = 1.0
+        width, height = np.ceil(extent).astype(int) + 2 * margin
+    else:
+        width, height = size
+        scale = min((width - 2 * margin) / extent[0], (height - 2 * margin) / extent[1])
+
+    # The drawing is centered on the image
+    center = np.array([width, height]) / 2
+    fitted = (points - (low + high) / 2) * scale * [1, -1] + center
+    return fitted.reshape(-1, 4).astype(np.float32), (int(height), int(width))
+
+
+_SUBPIXEL_BITS = 4
+
+
+# Moves of the turtle, and the index of every character among them (len(_MOVES) for other symbols)
+_MOVES = b"FS+-[]"
+_MOVE_KINDS = np.full(256, len(_MOVES), np.uint8)
+_MOVE_KINDS[list(_MOVES)] = np.arange(len(_MOVES))
+
+
+# For every move finds the innermost pair of brackets containing it (-1 outside of brackets),
+# and for every pair the position of its "]"
+def _brackets(moves):
+    opens = moves == _MOVES.index(b"[")
+    closes = moves == _MOVES.index(b"]")
+    # Depth of the moves; a "[" and a "]" themselves belong to the outer level
+    depths = np.cumsum(opens.astype(np.int64) - closes) - opens
+    if len(moves) and depths.min() < 0:
+        raise ValueError(f'"]" at move {np.argmax(depths < 0)} has no "[" to return to')
+
+    # Pairs are numbered in the order of (depth, position of "[") by sorting the keys depth * n + position
+    n = len(moves) + 1
+    open_positions = np.flatnonzero(opens)
+    open_keys = np.sort((depths[open_positions] + 1) * n + open_positions)
+    close_positions = np.flatnonzero(closes)
+    close_keys = np.sort((depths[close_positions] + 1) * n + close_positions)
+
+    # The pair of a move is the last "[" one level up before it, the "]" of a pair is the first one after its "["
+    groups = np.searchsorted(open_keys, depths * n + np.arange(len(moves))) - 1
+    groups[depths == 0] = -1
+    return groups, close_keys[np.searchsorted(close_keys, open_keys)] % n
+
+
+def draw_snowflake(file_name=None, size=None, cache=None):
     pen_width = 2
     f_len = 8
     angle = 60
     axiom = "F--F--F"
 
-    l_sys = LSystem2D(axiom, pen_width, f_len, angle)
+    l_sys = LSystem2D(axiom, pen_width, f_len, angle, cache)
     l_sys.add_rules(("F", "F+F--F+F"))
     l_sys.generate_path(4)
-    l_sys.draw_turtle((-300, 200), 0)
+    l_sys.draw((-300, 200), 0, file_name, size)
 
 
-def draw_dragon():
+def draw_dragon(file_name=None, size=None, cache=None):
     pen_width = 2
     f_len = 8
     angle = 90
     axiom = "FX"
 
-    l_sys = LSystem2D(axiom, pen_width, f_len, angle)
+    l_sys = LSystem2D(axiom, pen_width, f_len, angle, cache)
     l_sys.add_rules(("FX", "FX+FY+"), ("FY", "-FX-FY"))
     l_sys.generate_path(12)
-    l_sys.draw_turtle((200, -100), 0)
+    l_sys.draw((200, -100), 0, file_name, size)
 
 
-def draw_carpet():
+def draw_carpet(file_name=None, size=None, cache=None):
     pen_width = 2
     f_len = 8
     angle = 60
     axiom = "FXF--FF--FF"
 
-    l_sys = LSystem2D(axiom, pen_width, f_len, angle)
+    l_sys = LSystem2D(axiom, pen_width, f_len, angle, cache)
     l_sys.add_rules(("F", "FF"), ("X", "--FXF++FXF++FXF--"))
     l_sys.generate_path(5)
-    l_sys.draw_turtle((200, -200), -180)
+    l_sys.draw((200, -200), -180, file_name, size)
 
 
-def draw_gilbert():
+def draw_gilbert(file_name=None, size=None, cache=None):
     pen_width = 2
     f_len = 7
     angle = 90
     axiom = "X"
 
-    l_sys = LSystem2D(axiom, pen_width, f_len, angle)
+    l_sys = LSystem2D(axiom, pen_width, f_len, angle, cache)
     l_sys.add_rules(("X", "-YF+XFX+FY-"), ("Y", "+XF-YFY-FX+"))
     l_sys.generate_path(6)
-    l_sys.draw_turtle((200, -200), -180)
+    l_sys.draw((200, -200), -180, file_name, size)
 
 
-def draw_tree1():
+def draw_tree1(file_name=None, size=None, cache=None):
     pen_width = 2
     f_len = 7
     angle = 25.7
     axiom = "F"
 
-    l_sys = LSystem2D(axiom, pen_width, f_len, angle)
+    l_sys = LSystem2D(axiom, pen_width, f_len, angle, cache)
     l_sys.add_rules(("F", "F[+F]F[-F]F"))
     l_sys.generate_path(4)
-    l_sys.draw_turtle((0, -300), 90)
+    l_sys.draw((0, -300), 90, file_name, size)
 
 
-def draw_tree2():
+def draw_tree2(file_name=None, size=None, cache=None):
     pen_width = 2
     f_len = 15
     angle = 20
     axiom = "F"
 
-    l_sys = LSystem2D(axiom, pen_width, f_len, angle)
+    l_sys = LSystem2D(axiom, pen_width, f_len, angle, cache)
     l_sys.add_rules(("F", "F[+F]F[-F][F]"))
     l_sys.generate_path(4)
-    l_sys.draw_turtle((0, -300), 90)
+    l_sys.draw((0, -300), 90, file_name, size)
 
 
-def draw_tree3():
+def draw_tree3(file_name=None, size=None, cache=None):
     pen_width = 2
     f_len = 5
     angle = 25.7
     axiom = "X"
 
-    l_sys = LSystem2D(axiom, pen_width, f_len, angle)
+    l_sys = LSystem2D(axiom, pen_width, f_len, angle, cache)
     l_sys.add_rules(("F", "FF"), ("X", "F[+X][-X]FX"))
     l_sys.generate_path(6)
-    l_sys.draw_turtle((0, -300), 90)
+    l_sys.draw((0, -300), 90, file_name, size)
 
 
-def draw_tree4():
+def draw_tree4(file_name=None, size=None, cache=None):
     pen_width = 2
     f_len = 50
     angle = 20
     axiom = "F"
 
-    l_sys = LSystem2D(axiom, pen_width, f_len, angle)
+    l_sys = LSystem2D(axiom, pen_width, f_len, angle, cache)
     l_sys.add_rules(("F", "-F[-F+F-F]+[+F-F-F]"))
     l_sys.generate_path(3)
-    l_sys.draw_turtle((0, -300), 150)
+    l_sys.draw((0, -300), 150, file_name, size)
+
+
+PRESETS = {
+    "snowflake": draw_snowflake,
+    "dragon": draw_dragon,
+    "carpet": draw_carpet,
+    "gilbert": draw_gilbert,
+    "tree1": draw_tree1,
+    "tree2": draw_tree2,
+    "tree3": draw_tree3,
+    "tree4": draw_tree4,
+}
+
+
+# Renders the presets to files without opening a window
+def render_presets(argv):
+    """
+
+    :param argv: command line arguments
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description="Render L-system presets to image or SVG files")
+    parser.add_argument("output", help="directory for the files")
+    parser.add_argument("presets", nargs="*", metavar="preset",
+                        help=f"presets to render, all by default: {', '.join(PRESETS)}")
+    parser.add_argument("--format", nargs="+", default=["png"], choices=["png", "jpg", "bmp", "svg"])
+    parser.add_argument("--size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        help="fit the drawing into the size instead of one pixel per step")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="directory of a GeometryCache, the next runs reuse the generated states and segments")
+    args = parser.parse_args(argv)
+    unknown = set(args.presets) - set(PRESETS)
+    if unknown:
+        parser.error(f"unknown presets: {', '.join(sorted(unknown))}")
+
+    os.makedirs(args.output, exist_ok=True)
+    cache = GeometryCache(args.cache) if args.cache else None
+    for name in args.presets or PRESETS:
+        for extension in args.format:
+            file_name = os.path.join(args.output, f"{name}.{extension}")
+            start = time.perf_counter()
+            PRESETS[name](file_name, args.size, cache)
+            print(f"{file_name}: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    return 0
 
 
 if __name__ == "__main__":
+    # With command line arguments the presets are rendered to files, without them they are drawn by the turtle
+    if len(sys.argv) > 1:
+        sys.exit(render_presets(sys.argv[1:]))
+
     width = 1400
     height = 900
     screen = turtle.Screen()
@@ -1,19 +1,35 @@
+import argparse
 import cv2
+import glob
+import mmap
 import numpy as np
+import os
+import sys
+import threading
+import time
 import tkinter
-import math
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 from tkinter import font
 from tkinter.filedialog import askopenfilename
 
 
 class Image:
-    # Получение информации о файле по указанному пути
-    def __init__(self, path_to_image: str):
+    # Получение информации о файле по указанному пути. Файлы NumPy (.npy) и raw-файлы не читаются в память целиком,
+    # а отображаются в нее, поэтому растр может быть больше оперативной памяти
+    def __init__(self, path_to_image: str, shape=None):
         """
         :param path_to_image: full path to file
+        :param shape: высота и ширина изображения в raw-файле с пикселями BGR
         """
         self._name = path_to_image.split("/")[-1]
-        self._img = cv2.imdecode(np.fromfile(path_to_image, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if shape is not None:
+            self._img = np.memmap(path_to_image, np.uint8, "r", shape=(shape[0], shape[1], 3))
+        elif path_to_image.endswith(".npy"):
+            self._img = np.load(path_to_image, mmap_mode="r")
+        else:
+            self._img = cv2.imdecode(np.fromfile(path_to_image, dtype=np.uint8), cv2.IMREAD_COLOR)
         self._height = self._img.shape[0]
         self._width = self._img.shape[1]
         self._points = []
@@ -27,33 +43,7 @@ class Image:
         if len(self._points) < 6:
             return self._img
 
-        trans_mat = self._create_transformation_matrix()
-
-        new_img = np.zeros(self._img.shape, np.uint8)
-
-        # Вычисление обратной матрицы
-        inverse_trans_mat = np.linalg.inv(trans_mat[:, :2])
-        # Вычисление нового значение для каждого пикселя создаваемого изображения
-        for i in range(self._height):
-            for j in range(self._width):
-                x, y = inverse_trans_mat.dot(np.array([[i], [j]]) - trans_mat[:, 2:])
-
-                x, y = x[0], y[0]
-
-                if 0 <= x < self._height and 0 <= y < self._width:
-                    # Проверка невыхода округленных вверх значений координат за границы изображения
-                    ceil_x = math.ceil(x) if math.ceil(x) < self._height else math.floor(x)
-                    ceil_y = math.ceil(y) if math.ceil(y) < self._width else math.floor(y)
-
-                    color1 = np.array(self._img[math.floor(x), math.floor(y)])
-                    color2 = np.array(self._img[ceil_x, math.floor(y)])
-                    color3 = np.array(self._img[math.floor(x), ceil_y])
-                    color4 = np.array(self._img[ceil_x, ceil_y])
-
-                    new_img[i, j] = (((ceil_x - x) * color1 + (x - math.floor(x)) * color2) * (ceil_y - y) +
-                                     ((ceil_x - x) * color3 + (x - math.floor(x)) * color4) * (y - math.floor(y)))
-
-        return new_img
+        return warp_affine(self._img, self._create_transformation_matrix(), "bilinear")
 
     # Простейший алгоритм трансформации
     def simple_transform(self) -> np.ndarray:
@@ -64,23 +54,19 @@ class Image:
         if len(self._points) < 6:
             return self._img
 
-        trans_mat = self._create_transformation_matrix()
-
-        new_img = np.zeros(self._img.shape, np.uint8)
-
-        # Вычисление обратной матрицы
-        inverse_trans_mat = np.linalg.inv(trans_mat[:, :2])
-        # Вычисление нового значение для каждого пикселя создаваемого изображения
-        for i in range(self._height):
-            for j in range(self._width):
-                x, y = inverse_trans_mat.dot(np.array([[i], [j]]) - trans_mat[:, 2:])
+        return warp_affine(self._img, self._create_transformation_matrix(), "nearest")
 
-                x, y = round(x[0]), round(y[0])
-
-                if 0 <= x < self._height and 0 <= y < self._width:
-                    new_img[i, j] = self._img[x, y]
+    # Трансформация с указанным способом выборки цвета
+    def transform(self, mode="bilinear") -> np.ndarray:
+        """
+        :param mode: "nearest", "bilinear", "bicubic", "lanczos" или "area"
+        :return: новое преобразованное изображение
+        """
+        # Проверка количества указанных пользователем точек
+        if len(self._points) < 6:
+            return self._img
 
-        return new_img
+        return warp_affine(self._img, self._create_transformation_matrix(), mode)
 
     # Вывод изображения на экран с возможностью отмечать на нем точки. По нажатию Enter изображение будет закрыто
     def show(self):
@@ -95,32 +81,9 @@ class Image:
     # Генерация матрицы трансформации по 6 заданным точкам
     def _create_transformation_matrix(self) -> np.ndarray:
         """
-        :return: Матрица трансофрмации 3х3
-        """
-        # Матрица точек, заданных на исходном изображении (3 точки)
-        input_points = np.array([[self._points[0][0], self._points[1][0], self._points[2][0]],
-                                 [self._points[0][1], self._points[1][1], self._points[2][1]],
-                                 [                 1,                  1,                  1]])
-        # Матрица, состоящая из 3 точек соответствия
-        output_points = np.array([[self._points[3]], [self._points[4]], [self._points[5]]], np.float32)
-        transpose_output_points = np.array((output_points[0].T, output_points[1].T, output_points[2].T), np.float32)
-
-        column1 = (transpose_output_points[0] * np.linalg.det(input_points[1:, 1:]) -
-                   transpose_output_points[1] * np.linalg.det(np.hstack((input_points[1:, :1],
-                                                                         input_points[1:, 2:]))) +
-                   transpose_output_points[2] * np.linalg.det(input_points[1:, :2]))
-        column2 = (transpose_output_points[0] * np.linalg.det(np.vstack((input_points[:1, 1:],
-                                                                         input_points[2:, 1:]))) -
-                   transpose_output_points[1] * np.linalg.det(np.array([[input_points[0, 0], input_points[0, 2]],
-                                                                        [input_points[2, 0], input_points[2, 2]]])) +
-                   transpose_output_points[2] * np.linalg.det(np.vstack((input_points[:1, :2],
-                                                                         input_points[2:, :2])))) * -1
-        column3 = (transpose_output_points[0] * np.linalg.det(input_points[:2, 1:]) -
-                   transpose_output_points[1] * np.linalg.det(np.hstack((input_points[:2, :1],
-                                                                         input_points[:2, 2:]))) +
-                   transpose_output_points[2] * np.linalg.det(input_points[:2, :2]))
-
-        return np.hstack((column1, column2, column3)) / np.linalg.det(input_points)
+        :return: Матрица трансофрмации 2х3
+        """
+        return create_transformation_matrix(self._points)
 
     # Рисование точки на изображении по нажатии лкм
     def _draw_point(self, event, x, y, flags, param):
@@ -129,6 +92,435 @@ class Image:
             cv2.circle(self._img, (x, y), 5, (255, 255, 0), -1)
 
 
+# Генерация матрицы трансформации по 6 точкам: 3 точкам исходного изображения и 3 соответствующим им точкам нового
+def create_transformation_matrix(points: list) -> np.ndarray:
+    """
+    :param points: 6 точек [x, y]
+    :return: Матрица трансофрмации 2х3
+    """
+    # Матрица точек, заданных на исходном изображении (3 точки)
+    input_points = np.array([[points[0][0], points[1][0], points[2][0]],
+                             [points[0][1], points[1][1], points[2][1]],
+                             [           1,            1,            1]])
+    # Матрица, состоящая из 3 точек соответствия
+    output_points = np.array([[points[3]], [points[4]], [points[5]]], np.float32)
+    transpose_output_points = np.array((output_points[0].T, output_points[1].T, output_points[2].T), np.float32)
+
+    column1 = (transpose_output_points[0] * np.linalg.det(input_points[1:, 1:]) -
+               transpose_output_points[1] * np.linalg.det(np.hstack((input_points[1:, :1],
+                                                                     input_points[1:, 2:]))) +
+               transpose_output_points[2] * np.linalg.det(input_points[1:, :2]))
+    column2 = (transpose_output_points[0] * np.linalg.det(np.vstack((input_points[:1, 1:],
+                                                                     input_points[2:, 1:]))) -
+               transpose_output_points[1] * np.linalg.det(np.array([[input_points[0, 0], input_points[0, 2]],
+                                                                    [input_points[2, 0], input_points[2, 2]]])) +
+               transpose_output_points[2] * np.linalg.det(np.vstack((input_points[:1, :2],
+                                                                     input_points[2:, :2])))) * -1
+    column3 = (transpose_output_points[0] * np.linalg.det(input_points[:2, 1:]) -
+               transpose_output_points[1] * np.linalg.det(np.hstack((input_points[:2, :1],
+                                                                     input_points[:2, 2:]))) +
+               transpose_output_points[2] * np.linalg.det(input_points[:2, :2]))
+
+    return np.hstack((column1, column2, column3)) / np.linalg.det(input_points)
+
+
+# Таблица обратного отображения: для каждого пикселя нового изображения, попадающего в исходное, хранятся
+# смещения строк и номера столбцов исходных пикселей и их веса по каждой оси
+class RemapTable:
+    def __init__(self, inside: np.ndarray, rows: np.ndarray, cols: np.ndarray, row_weights=None, col_weights=None,
+                 level=0):
+        """
+        :param inside: номера (в развернутом в строку изображении) пикселей нового изображения, попадающих в исходное
+        :param rows: int32 матрица T x N смещений строк исходных пикселей (номер строки, умноженный на ширину)
+        :param cols: int32 матрица T x N номеров столбцов исходных пикселей
+        :param row_weights: float32 матрица T x N весов строк, None для ближайшего пикселя
+        :param col_weights: float32 матрица T x N весов столбцов
+        :param level: уровень пирамиды уменьшенных копий исходного изображения, из которого берутся цвета
+        """
+        self.inside = inside
+        self.rows = rows
+        self.cols = cols
+        self.row_weights = row_weights
+        self.col_weights = col_weights
+        self.level = level
+
+    # Объем памяти, занимаемый таблицей
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.inside, self.rows, self.cols, self.row_weights, self.col_weights)
+                   if array is not None)
+
+    # Выборка и смешивание цветов исходного изображения для пикселей таблицы
+    def sample(self, img: np.ndarray) -> np.ndarray:
+        """
+        :param img: исходное изображение
+        :return: матрица N x 3 цветов пикселей нового изображения
+        """
+        # Выборка по номерам пикселей в развернутом в строку изображении быстрее выборки по паре индексов
+        pixels = img.reshape(-1, img.shape[2])
+        if self.row_weights is None:
+            return np.take(pixels, self.rows[0] + self.cols[0], axis=0)
+
+        # Цвета смешиваются сначала по строкам, затем по столбцам, во временных массивах без лишних выделений памяти
+        colors = np.zeros((len(self.inside), img.shape[2]), np.float32)
+        column = np.empty_like(colors)
+        term = np.empty_like(colors)
+        for col, col_weight in zip(self.cols, self.col_weights):
+            column.fill(0)
+            for row, row_weight in zip(self.rows, self.row_weights):
+                np.multiply(np.take(pixels, row + col, axis=0), row_weight[:, np.newaxis], out=term)
+                column += term
+            column *= col_weight[:, np.newaxis]
+            colors += column
+
+        return colors
+
+
+# Кэш таблиц обратного отображения. Одна и та же матрица трансформации применяется к множеству кадров одного размера,
+# поэтому таблица вычисляется один раз, а для остальных кадров остаются только выборка и смешивание цветов.
+# При превышении заданного объема памяти удаляются давно не использованные таблицы
+class RemapCache:
+    def __init__(self, max_bytes=512 * 2 ** 20):
+        """
+        :param max_bytes: максимальный суммарный объем таблиц в байтах
+        """
+        self.max_bytes = max_bytes
+        self._tables = OrderedDict()
+        self._nbytes = 0
+        # Кэш используется из нескольких потоков пакетной обработки
+        self._lock = threading.Lock()
+        # Вычисляемые сейчас таблицы: событие окончания вычисления и таблица (None, если вычисление не удалось).
+        # Остальные потоки, которым нужна та же таблица, ждут ее, а не вычисляют ее одновременно
+        self._builds = {}
+
+    # Получение таблицы из кэша или ее вычисление
+    def get(self, trans_mat: np.ndarray, shape: tuple, mode: str) -> RemapTable:
+        """
+        :param trans_mat: матрица трансформации 2х3
+        :param shape: размер изображения
+        :param mode: способ выборки цвета
+        :return: таблица обратного отображения
+        """
+        key = (np.asarray(trans_mat, np.float64).tobytes(), tuple(shape[:2]), mode)
+        while True:
+            with self._lock:
+                table = self._tables.get(key)
+                if table is not None:
+                    self._tables.move_to_end(key)
+                    return table
+                build = self._builds.get(key)
+                if build is None:
+                    build = self._builds[key] = [threading.Event(), None]
+                    break
+
+            build[0].wait()
+            if build[1] is not None:
+                return build[1]
+
+        try:
+            table = build[1] = _build_remap_table(trans_mat, shape, mode)
+        finally:
+            with self._lock:
+                del self._builds[key]
+                if build[1] is not None and build[1].nbytes <= self.max_bytes:
+                    self._tables[key] = build[1]
+                    self._nbytes += build[1].nbytes
+                    while self._nbytes > self.max_bytes:
+                        self._nbytes -= self._tables.popitem(last=False)[1].nbytes
+            build[0].set()
+
+        return table
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._nbytes = 0
+
+
+remap_cache = RemapCache()
+
+
+# Аффинное преобразование изображения обратным отображением: для каждого пикселя нового изображения вычисляется
+# точка исходного изображения, из которой берется его цвет
+def warp_affine(img: np.ndarray, trans_mat: np.ndarray, mode="bilinear", cache=remap_cache) -> np.ndarray:
+    """
+    :param img: исходное изображение
+    :param trans_mat: матрица трансформации 2х3, переводящая точку (строка, столбец) исходного изображения в новое
+    :param mode: "nearest" - ближайший пиксель, "bilinear" - билинейная фильтрация, "bicubic" - бикубическая,
+                 "lanczos" - фильтр Ланцоша с радиусом 3, "area" - билинейная фильтрация уменьшенной копии изображения
+                 (mip-уровня), соответствующей масштабу преобразования
+    :param cache: кэш таблиц обратного отображения, None - вычислять таблицу заново
+    :return: новое преобразованное изображение того же размера
+    """
+    table = cache.get(trans_mat, img.shape, mode) if cache is not None else _build_remap_table(trans_mat, img.shape, mode)
+
+    new_img = np.zeros(img.shape, np.uint8)
+    _apply_remap_table(table, _pyramid_level(img, table.level), new_img)
+
+    return new_img
+
+
+# Аффинное преобразование большого изображения по частям в пуле процессов. Каждый процесс вычисляет координаты только
+# для своего прямоугольного фрагмента нового изображения и записывает его в новое изображение, поэтому объем памяти
+# процесса ограничен размером фрагмента. Отображенные в память файлы процессы открывают заново, остальные изображения
+# передаются им через общую (shared memory) память, поэтому для растров больше памяти источником и результатом
+# должны быть файлы: тогда процесс, вызвавший функцию, не держит в памяти ни одной копии растра
+def warp_affine_tiled(img: np.ndarray, trans_mat: np.ndarray, mode="bilinear", tile=1024, workers=None,
+                      out=None) -> np.ndarray:
+    """
+    :param img: исходное изображение, в том числе отображенное в память (np.memmap)
+    :param trans_mat: матрица трансформации 2х3
+    :param mode: "nearest", "bilinear", "bicubic", "lanczos" или "area"
+    :param tile: сторона фрагмента в пикселях
+    :param workers: количество процессов, по умолчанию количество процессоров
+    :param out: массив uint8 размера изображения для результата (в том числе np.memmap) или имя создаваемого
+                файла .npy. По умолчанию создается новый массив
+    :return: новое преобразованное изображение того же размера, совпадающее с результатом warp_affine, - out,
+             если он задан
+    """
+    height, width = img.shape[:2]
+    level = _mipmap_level(np.linalg.inv(trans_mat[:, :2]), img.shape) if mode == "area" else 0
+    source = _pyramid_level(img, level)
+
+    if isinstance(out, str):
+        out = np.lib.format.open_memmap(out, "w+", np.uint8, img.shape)
+    elif out is not None and (out.shape != img.shape or out.dtype != np.uint8):
+        raise ValueError(f"out должен быть массивом uint8 размера {img.shape}")
+
+    memories = []
+    try:
+        source_spec = _share(source, memories)
+        output_spec = _share(out, memories, img.shape)
+
+        rects = [(top, min(top + tile, height), left, min(left + tile, width))
+                 for top in range(0, height, tile) for left in range(0, width, tile)]
+        with ProcessPoolExecutor(workers, initializer=_init_tile_worker,
+                                 initargs=(source_spec, output_spec, trans_mat, mode)) as executor:
+            list(executor.map(_warp_tile, rects))
+
+        if output_spec[1] is not None:
+            out.flush()
+            return out
+        output = np.ndarray(img.shape, np.uint8, memories[-1].buf)
+        if out is None:
+            return output.copy()
+        out[:] = output
+        return out
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+
+# Описание изображения для процессов пула: имя файла и смещение в нем для отображенного в память изображения,
+# иначе имя общей памяти и None, размер и тип. Изображение копируется в общую память, если оно не пустое
+def _share(img, memories: list, shape=None) -> tuple:
+    """
+    :param img: изображение или None для нового изображения размера shape
+    :param memories: список созданных блоков общей памяти, в который добавляется новый блок
+    """
+    mapping = _mapped_file(img) if img is not None else None
+    if mapping is not None:
+        return mapping + (img.shape, img.dtype.str)
+
+    shape, dtype = (img.shape, img.dtype) if img is not None else (shape, np.dtype(np.uint8))
+    memory = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * dtype.itemsize)
+    memories.append(memory)
+    if img is not None:
+        np.ndarray(shape, dtype, memory.buf)[:] = img
+    return memory.name, None, shape, dtype.str
+
+
+# Файл и смещение в нем данных изображения, отображенного в память, или None, если изображение нельзя заново
+# открыть по имени: оно не отображено в память или является несплошным срезом отображенного файла
+def _mapped_file(img: np.ndarray):
+    if not isinstance(img, np.memmap) or not img.flags.c_contiguous:
+        return None
+
+    # Смещение среза отсчитывается от начала массива, созданного np.memmap, а его атрибут offset
+    # у среза остается таким же, как у исходного массива
+    root = img
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if not isinstance(root, np.memmap) or not isinstance(root.base, mmap.mmap) or root.filename is None:
+        return None
+    return root.filename, root.offset + img.ctypes.data - root.ctypes.data
+
+
+# Данные процесса пула warp_affine_tiled: исходное и новое изображения, блоки общей памяти и параметры
+_tile_worker = {"memories": []}
+
+
+# Подключение процесса пула к исходному и новому изображениям
+def _init_tile_worker(source_spec: tuple, output_spec: tuple, trans_mat: np.ndarray, mode: str):
+    _tile_worker["source"] = _attach(source_spec, "r")
+    _tile_worker["output"] = _attach(output_spec, "r+")
+    _tile_worker["shape"] = output_spec[2]
+    _tile_worker["trans_mat"] = trans_mat
+    _tile_worker["mode"] = mode
+
+
+# Изображение по описанию _share
+def _attach(spec: tuple, mode: str) -> np.ndarray:
+    name, offset, shape, dtype = spec
+    if offset is not None:
+        return np.memmap(name, dtype, mode, offset, shape)
+    memory = shared_memory.SharedMemory(name)
+    _tile_worker["memories"].append(memory)
+    return np.ndarray(shape, dtype, memory.buf)
+
+
+# Преобразование одного фрагмента нового изображения в процессе пула
+def _warp_tile(rect: tuple):
+    """
+    :param rect: первая строка, следующая за последней строка, первый столбец и следующий за последним столбец
+    """
+    top, bottom, left, right = rect
+    table = _build_remap_table(_tile_worker["trans_mat"], _tile_worker["shape"], _tile_worker["mode"], rect)
+
+    # Исходное изображение уже уменьшено до нужного mip-уровня в warp_affine_tiled
+    new_tile = np.zeros((bottom - top, right - left, _tile_worker["shape"][2]), np.uint8)
+    _apply_remap_table(table, _tile_worker["source"], new_tile)
+    _tile_worker["output"][top:bottom, left:right] = new_tile
+
+
+# Заполнение нового изображения или его фрагмента цветами исходного изображения по таблице обратного отображения
+def _apply_remap_table(table: RemapTable, img: np.ndarray, new_img: np.ndarray):
+    """
+    :param table: таблица обратного отображения
+    :param img: исходное изображение или его mip-уровень table.level
+    :param new_img: новое изображение или фрагмент, для которого построена таблица
+    """
+    colors = table.sample(img)
+    # Бикубическое ядро и ядро Ланцоша имеют отрицательные веса, поэтому цвета могут выйти за допустимые пределы
+    if table.row_weights is not None:
+        np.clip(colors, 0, 255, out=colors)
+
+    # Пиксели, для которых точка выходит за границы исходного изображения, остаются черными
+    new_img.reshape(-1, new_img.shape[2])[table.inside] = colors
+
+
+# Вычисление таблицы обратного отображения
+def _build_remap_table(trans_mat: np.ndarray, shape: tuple, mode: str, rect=None) -> RemapTable:
+    """
+    :param trans_mat: матрица трансформации 2х3, переводящая точку (строка, столбец) исходного изображения в новое
+    :param shape: размер изображения
+    :param mode: "nearest", "bilinear", "bicubic", "lanczos" или "area"
+    :param rect: фрагмент нового изображения (первая и следующая за последней строки, первый и следующий за последним
+                 столбцы), по умолчанию все изображение. Номера пикселей таблицы отсчитываются внутри фрагмента
+    :return: таблица обратного отображения
+    """
+    height, width = shape[:2]
+    top, bottom, left, right = rect if rect is not None else (0, height, 0, width)
+
+    # Координаты исходного изображения для всех пикселей нового вычисляются одним умножением матриц
+    inverse_trans_mat = np.linalg.inv(trans_mat[:, :2])
+    grid = np.mgrid[top:bottom, left:right].reshape(2, -1) - trans_mat[:, 2:]
+    x, y = inverse_trans_mat @ grid
+
+    if mode == "nearest":
+        x, y = np.rint(x), np.rint(y)
+
+    inside = np.flatnonzero((0 <= x) & (x < height) & (0 <= y) & (y < width))
+    x, y = x[inside], y[inside]
+    # Номера пикселей больших растров не помещаются в int32
+    index_type = np.int32 if height * width < 2 ** 31 else np.int64
+    inside = inside.astype(index_type)
+
+    if mode == "nearest":
+        return RemapTable(inside, (x.astype(index_type) * width)[np.newaxis], y.astype(index_type)[np.newaxis])
+
+    # При уменьшении изображения цвета берутся из mip-уровня, на котором один пиксель нового изображения
+    # соответствует примерно одному пикселю уровня. Координаты пересчитываются для центров пикселей уровня
+    level = 0
+    if mode == "area":
+        level = _mipmap_level(inverse_trans_mat, shape)
+        level_height, level_width = _level_shape(shape, level)
+        x = (x + 0.5) * level_height / height - 0.5
+        y = (y + 0.5) * level_width / width - 0.5
+        height, width = level_height, level_width
+        mode = "bilinear"
+
+    radius, kernel = _KERNELS[mode]
+    rows, row_weights = _taps(x, height, radius, kernel, index_type)
+    cols, col_weights = _taps(y, width, radius, kernel, index_type)
+
+    return RemapTable(inside, rows * index_type(width), cols, row_weights, col_weights, level)
+
+
+# Отсчеты ядра интерполяции вдоль одной оси
+def _taps(x: np.ndarray, size: int, radius: int, kernel, index_type) -> tuple:
+    """
+    :param x: координаты точек вдоль оси
+    :param size: количество пикселей вдоль оси
+    :param radius: радиус ядра
+    :param kernel: функция веса отсчета от расстояния до него
+    :param index_type: тип номеров пикселей
+    :return: матрица 2 * radius x N номеров пикселей и float32 матрица их весов
+    """
+    floor_x = np.floor(x)
+    taps = floor_x + np.arange(1 - radius, radius + 1)[:, np.newaxis]
+    weights = kernel(x - taps)
+    # Сумма весов ядер бикубического и Ланцоша не равна точно единице
+    if radius > 1:
+        weights /= weights.sum(axis=0)
+
+    # Отсчеты за краями изображения заменяются крайними пикселями, веса при этом не меняются
+    return np.clip(taps, 0, size - 1).astype(index_type), weights.astype(np.float32)
+
+
+# Бикубическое ядро Кейса (a = -0.5)
+def _cubic(d: np.ndarray) -> np.ndarray:
+    d = np.abs(d)
+    return np.where(d <= 1, (1.5 * d - 2.5) * d * d + 1, ((-0.5 * d + 2.5) * d - 4) * d + 2)
+
+
+# Ядро Ланцоша с радиусом 3
+def _lanczos(d: np.ndarray) -> np.ndarray:
+    return np.where(np.abs(d) < 3, np.sinc(d) * np.sinc(d / 3), 0)
+
+
+# Радиусы ядер интерполяции и веса отсчетов в зависимости от расстояния до них
+_KERNELS = {
+    "bilinear": (1, lambda d: 1 - np.abs(d)),
+    "bicubic": (2, _cubic),
+    "lanczos": (3, _lanczos),
+}
+
+
+# Выбор mip-уровня по якобиану обратного преобразования: смещение в исходном изображении при шаге на один пиксель
+# нового изображения вдоль строки и столбца
+def _mipmap_level(inverse_trans_mat: np.ndarray, shape: tuple) -> int:
+    """
+    :param inverse_trans_mat: обратная матрица трансформации 2х2
+    :param shape: размер изображения
+    :return: номер уровня, 0 - исходное изображение
+    """
+    step = max(np.hypot(*inverse_trans_mat[:, 0]), np.hypot(*inverse_trans_mat[:, 1]))
+    if step <= 1:
+        return 0
+
+    return int(min(round(np.log2(step)), np.log2(min(shape[:2]))))
+
+
+# Размер уровня пирамиды: на каждом уровне размер уменьшается вдвое с округлением вверх
+def _level_shape(shape: tuple, level: int) -> tuple:
+    height, width = shape[:2]
+    for _ in range(level):
+        height, width = (height + 1) // 2, (width + 1) // 2
+
+    return height, width
+
+
+# Уменьшенная копия изображения заданного уровня пирамиды: каждый уровень получается усреднением пикселей предыдущего
+def _pyramid_level(img: np.ndarray, level: int) -> np.ndarray:
+    for _ in range(level):
+        height, width = _level_shape(img.shape, 1)
+        img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+
+    return img
+
+
 class App(tkinter.Frame):
     def __init__(self, parent):
         super().__init__(parent)
@@ -180,7 +572,94 @@ class App(tkinter.Frame):
         self.parent.geometry('%dx%d+%d+%d' % (self.window_width, self.window_height, x, y))
 
 
+# Трансформация одного файла пакета: чтение, преобразование и запись
+def _transform_file(path: str, output_dir: str, trans_mat: np.ndarray, mode: str) -> tuple:
+    """
+    :return: количество пикселей и время обработки в секундах
+    """
+    start = time.perf_counter()
+    img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("не удалось прочитать изображение")
+
+    new_img = warp_affine(img, trans_mat, mode)
+
+    ok, encoded = cv2.imencode(os.path.splitext(path)[1] or ".png", new_img)
+    if not ok:
+        raise ValueError("не удалось записать изображение")
+    encoded.tofile(os.path.join(output_dir, os.path.basename(path)))
+
+    return img.shape[0] * img.shape[1], time.perf_counter() - start
+
+
+# Пакетная трансформация изображений без графического интерфейса. Файлы обрабатываются в пуле потоков: чтение и запись
+# одних файлов идут одновременно с преобразованием других, а число одновременно обрабатываемых файлов ограничено
+def batch_transform(argv: list) -> int:
+    """
+    :param argv: аргументы командной строки
+    :return: код завершения
+    """
+    parser = argparse.ArgumentParser(description="Аффинная трансформация каталога изображений")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--points", type=float, nargs=12, metavar="N",
+                        help="3 точки исходного изображения и 3 соответствующие им точки нового: x1 y1 ... x6 y6")
+    source.add_argument("--matrix", type=float, nargs=6, metavar="N", help="матрица трансформации 2х3 по строкам")
+    parser.add_argument("input", help="каталог с изображениями или шаблон имен файлов, например 'frames/*.png'")
+    parser.add_argument("output", help="каталог для преобразованных изображений")
+    parser.add_argument("--mode", default="bilinear", choices=["nearest", "bilinear", "bicubic", "lanczos", "area"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="количество потоков")
+    args = parser.parse_args(argv)
+
+    if args.points is not None:
+        trans_mat = create_transformation_matrix(np.reshape(args.points, (6, 2)).tolist())
+    else:
+        trans_mat = np.reshape(args.matrix, (2, 3))
+
+    if os.path.isdir(args.input):
+        paths = sorted(os.path.join(args.input, name) for name in os.listdir(args.input)
+                       if name.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")))
+    else:
+        paths = sorted(glob.glob(args.input))
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    total_pixels = 0
+    failed = 0
+    with ThreadPoolExecutor(args.workers) as executor:
+        pending = deque()
+
+        def report(path, future):
+            nonlocal total_pixels, failed
+            try:
+                pixels, seconds = future.result()
+            except Exception as error:
+                failed += 1
+                print(f"{path}: ошибка: {error}", file=sys.stderr)
+                return
+            total_pixels += pixels
+            print(f"{path}: {seconds * 1000:.1f} мс, {pixels / seconds / 1e6:.1f} Мпикс/с")
+
+        for path in paths:
+            # В обработке находится не больше двух файлов на поток
+            if len(pending) >= 2 * args.workers:
+                report(*pending.popleft())
+            pending.append((path, executor.submit(_transform_file, path, args.output, trans_mat, args.mode)))
+        while pending:
+            report(*pending.popleft())
+
+    seconds = time.perf_counter() - start
+    done = len(paths) - failed
+    print(f"Итого: {done} изображений, {total_pixels / 1e6:.1f} Мпикс за {seconds:.2f} с: "
+          f"{done / seconds if seconds else 0:.1f} изобр/с, {total_pixels / 1e6 / seconds if seconds else 0:.1f} Мпикс/с")
+
+    return 1 if failed else 0
+
+
 if __name__ == '__main__':
+    # С аргументами командной строки изображения обрабатываются пакетно, без них запускается графический интерфейс
+    if len(sys.argv) > 1:
+        sys.exit(batch_transform(sys.argv[1:]))
+
     root = tkinter.Tk()
     app = App(root)
     root.mainloop()
@@ -0,0 +1,433 @@
+"""
+Headless benchmarks of the labs: convolution (Лаб_2), affine warping (Lab_3), L-system generation (Lab3.1)
+and Bezier spline evaluation (Лаб_1) on synthetic inputs of growing size.
+
+Every case reports the best time of several runs, the peak memory allocated by NumPy and Python
+(tracemalloc, OpenCV buffers are not seen) and the throughput. Results are compared with a JSON baseline:
+a case slower than the baseline by more than the threshold, or with a different output, is a regression.
+Before the timing the outputs are checked against the original per-pixel and per-sample implementations
+on small inputs.
+
+    python benchmark.py --save              # store the baseline
+    python benchmark.py                     # compare with it
+    python benchmark.py --only warping --max-image 8192
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from instrumentation import Profiler, load_lab
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+GROUPS = ("convolution", "warping", "lsystem", "bezier")
+
+
+# Synthetic BGR image: smooth gradients with noise, so that neither the filters nor the sampling see a constant
+def _synthetic_image(side: int) -> np.ndarray:
+    rng = np.random.default_rng(side)
+    y, x = np.ogrid[:side, :side]
+    img = np.empty((side, side, 3), np.uint8)
+    img[..., 0] = (x * 255 // max(side - 1, 1)).astype(np.uint8)
+    img[..., 1] = (y * 255 // max(side - 1, 1)).astype(np.uint8)
+    img[..., 2] = rng.integers(0, 256, (side, side), np.uint8)
+    return img
+
+
+# Rotation by 30 degrees with scaling by 0.9 around the center, in the (row, column) coordinates of Lab_3
+def _rotation(side: int) -> np.ndarray:
+    angle = math.radians(30)
+    linear = 0.9 * np.array([[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]])
+    center = np.array([side / 2, side / 2])
+    return np.hstack((linear, (center - linear @ center)[:, None]))
+
+
+def _digest(result) -> str:
+    return hashlib.sha1(np.ascontiguousarray(result).tobytes()).hexdigest()
+
+
+# Golden references: the original implementations of the labs
+
+def _reference_warp(img: np.ndarray, trans_mat: np.ndarray, mode: str) -> tuple:
+    """
+
+    :return: new image and the mask of its pixels where the original bilinear weights did not degenerate
+    """
+    height, width = img.shape[:2]
+    new_img = np.zeros(img.shape, np.uint8)
+    valid = np.zeros((height, width), bool)
+    inverse_trans_mat = np.linalg.inv(trans_mat[:, :2])
+    for i in range(height):
+        for j in range(width):
+            x, y = inverse_trans_mat.dot(np.array([[i], [j]]) - trans_mat[:, 2:])
+            x, y = x[0], y[0]
+            if mode == "nearest":
+                x, y = round(x), round(y)
+                if 0 <= x < height and 0 <= y < width:
+                    new_img[i, j] = img[x, y]
+                    valid[i, j] = True
+            elif 0 <= x < height and 0 <= y < width:
+                ceil_x = math.ceil(x) if math.ceil(x) < height else math.floor(x)
+                ceil_y = math.ceil(y) if math.ceil(y) < width else math.floor(y)
+
+                color1 = np.array(img[math.floor(x), math.floor(y)])
+                color2 = np.array(img[ceil_x, math.floor(y)])
+                color3 = np.array(img[math.floor(x), ceil_y])
+                color4 = np.array(img[ceil_x, ceil_y])
+
+                new_img[i, j] = (((ceil_x - x) * color1 + (x - math.floor(x)) * color2) * (ceil_y - y) +
+                                 ((ceil_x - x) * color3 + (x - math.floor(x)) * color4) * (y - math.floor(y)))
+                valid[i, j] = ceil_x != math.floor(x) and ceil_y != math.floor(y)
+    return new_img, valid
+
+
+def _reference_generation(axiom: str, rules: list, n_iter: int) -> str:
+    state = axiom
+    for n in range(n_iter):
+        for key, value in rules:
+            state = state.replace(key, value.lower())
+        state = state.upper()
+    return state
+
+
+def _reference_segments(state: str, length: float, angle: float) -> np.ndarray:
+    x, y, heading = 0.0, 0.0, 0.0
+    stack = []
+    segments = []
+    for move in state:
+        if move in "FS":
+            new_x = x + length * math.cos(math.radians(heading))
+            new_y = y + length * math.sin(math.radians(heading))
+            if move == "F":
+                segments.append((x, y, new_x, new_y))
+            x, y = new_x, new_y
+        elif move == "+":
+            heading += angle
+        elif move == "-":
+            heading -= angle
+        elif move == "[":
+            stack.append((x, y, heading))
+        elif move == "]":
+            x, y, heading = stack.pop()
+    return np.array(segments).reshape(-1, 4)
+
+
+def _reference_controls(points: list) -> np.ndarray:
+    segments = []
+    next_p = points[0]
+    for i in range(len(points) - 2):
+        aj1 = ((points[i][0] + points[i + 1][0]) / 2, (points[i][1] + points[i + 1][1]) / 2)
+        aj2 = ((points[i + 1][0] + points[i + 2][0]) / 2, (points[i + 1][1] + points[i + 2][1]) / 2)
+        lam = (math.hypot(points[i + 1][0] - points[i][0], points[i + 1][1] - points[i][1]) /
+               math.hypot(points[i + 2][0] - points[i + 1][0], points[i + 2][1] - points[i + 1][1]))
+        bj = ((aj1[0] + lam * aj2[0]) / (1 + lam), (aj1[1] + lam * aj2[1]) / (1 + lam))
+        pi1 = (aj1[0] - bj[0] + points[i + 1][0], aj1[1] - bj[1] + points[i + 1][1])
+        pi2 = (aj2[0] - bj[0] + points[i + 1][0], aj2[1] - bj[1] + points[i + 1][1])
+        segments.append((points[i], next_p, pi1, points[i + 1]))
+        next_p = pi2
+    segments.append((points[-2], next_p, points[-1], points[-1]))
+    return np.array(segments, np.float64)
+
+
+def _random_points(count: int) -> list:
+    rng = np.random.default_rng(count)
+    return [tuple(point) for point in rng.uniform((0, 0), (1000, 600), (count, 2)).tolist()]
+
+
+LSYSTEMS = {
+    # The dragon grows as 2 ** n, the plant as 5 ** n, so the plant gets half the depth
+    "dragon": ("FX", [("FX", "FX+FY+"), ("FY", "-FX-FY")], 90, 1),
+    "plant": ("F", [("F", "F[+F]F[-F]F")], 25.7, 2),
+}
+
+
+# Every check returns a list of failure messages
+
+def _check_convolution(lab2, directory: str) -> list:
+    img = _synthetic_image(48)
+    path = os.path.join(directory, "check.npy")
+    np.save(path, img)
+    image = lab2.Image(path, workers=3)
+    failures = []
+    for name, flt in lab2.FILTERS.items():
+        expected = np.zeros((img.shape[0] - 2, img.shape[1] - 2, 3))
+        for channel in range(3):
+            plane = np.zeros(expected.shape[:2])
+            image._convolution_ahsl(flt.core, img[..., channel], plane, flt.offset)
+            expected[..., channel] = plane
+        if not np.array_equal(image._convolution_rgb(flt.core, flt.offset), expected):
+            failures.append(f"convolution {name} differs from the per-pixel loop")
+    return failures
+
+
+def _check_warping(lab3) -> list:
+    img = _synthetic_image(40)
+    trans_mat = _rotation(40)
+    failures = []
+    for mode in ("nearest", "bilinear"):
+        expected, valid = _reference_warp(img, trans_mat, mode)
+        result = lab3.warp_affine(img, trans_mat, mode, cache=None)
+        difference = np.abs(result[valid].astype(int) - expected[valid]).max(initial=0)
+        # The bilinear weights are computed in float32, which moves some pixels by one level
+        if difference > (0 if mode == "nearest" else 1):
+            failures.append(f"warping {mode} differs from the per-pixel loop by {difference}")
+    return failures
+
+
+def _check_lsystem(lab31) -> list:
+    failures = []
+    for name, (axiom, rules, angle, scale) in LSYSTEMS.items():
+        n_iter = 8 // scale
+        l_sys = lab31.LSystem2D(axiom, 2, 5, angle)
+        l_sys.add_rules(*rules)
+        l_sys.generate_path(n_iter)
+        if l_sys.state != _reference_generation(axiom, rules, n_iter):
+            failures.append(f"L-system {name} state differs from str.replace generation")
+        expected = _reference_segments(l_sys.state, 5, angle)
+        segments = l_sys.segments()[0]
+        if segments.shape != expected.shape or np.abs(segments - expected).max(initial=0) > 1e-3:
+            failures.append(f"L-system {name} segments differ from the turtle walk")
+
+        # Splitting the state into symbols again between the generations must not change the result
+        l_sys = lab31.LSystem2D(axiom, 2, 5, angle)
+        l_sys.add_rules(*rules)
+        l_sys.generate_path(n_iter // 2)
+        l_sys.state = l_sys.state
+        l_sys.generate_path(n_iter - n_iter // 2)
+        if l_sys.state != _reference_generation(axiom, rules, n_iter):
+            failures.append(f"L-system {name} state changes when it is assigned between the generations")
+
+    # Symbols are rewritten separately, so a predecessor formed across two of them has to be rejected
+    l_sys = lab31.LSystem2D("AX", 2, 5, 90)
+    l_sys.add_rules(("A", "F"), ("FX", "Y"))
+    try:
+        l_sys.generate_path(2)
+        failures.append("L-system with a predecessor across two symbols is not rejected")
+    except ValueError:
+        pass
+    return failures
+
+
+def _check_bezier(lab1) -> list:
+    points = _random_points(12)
+    controls = lab1.BezierLines.calcControlPoints(points)[0]
+    failures = []
+    if np.abs(controls - _reference_controls(points)).max() > 1e-9:
+        failures.append("Bezier control points differ from drawLines")
+    samples = np.linspace(0, 1, 101)
+    curves = lab1.BezierLines.bezierBasis(len(samples)) @ controls
+    expected = np.array([[[lab1.BezierLines.calcBezierCoordinate(*control[:, axis], t) for axis in (0, 1)]
+                          for t in samples] for control in controls])
+    if np.abs(curves - expected).max() > 1e-9:
+        failures.append("Bezier basis evaluation differs from calcBezierCoordinate")
+    tolerance = 0.25
+    flattened = lab1.BezierLines.flattenBezier(controls, tolerance)[0]
+    dense = lab1.BezierLines.bezierBasis(2001) @ controls
+    for curve, polyline in zip(dense, flattened):
+        start, end = polyline[:-1], polyline[1:]
+        direction = end - start
+        t = np.clip(((curve[:, None] - start) * direction).sum(-1) / np.maximum((direction ** 2).sum(-1), 1e-12), 0, 1)
+        distance = np.hypot(*(start + t[..., None] * direction - curve[:, None]).transpose(2, 0, 1)).min(axis=1)
+        if distance.max() > tolerance + 1e-9:
+            failures.append(f"adaptive Bezier flattening strays {distance.max():.3f} px from the curve")
+            break
+    return failures
+
+
+# Cases: (name, function that runs the operation and returns its output, amount of work or None
+# for the length of the output, unit of throughput)
+
+def _convolution_cases(lab2, directory: str, args) -> list:
+    cases = []
+    for side in _sizes(256, args.max_image):
+        image = lab2.Image(_save_once(directory, side))
+        for name in ("blur", "sharpen", "emboss"):
+            flt = lab2.FILTERS[name]
+            cases.append((f"convolution/{name}/{side}", lambda image=image, flt=flt:
+                          image._convolution_rgb(flt.core, flt.offset), side * side, "pixels"))
+        core = lab2.gaussian_core(15)
+        cases.append((f"convolution/gaussian15/{side}", lambda image=image, core=core:
+                      image._convolution_rgb(core), side * side, "pixels"))
+    return cases
+
+
+def _warping_cases(lab3, directory: str, args) -> list:
+    cases = []
+    for side in _sizes(256, args.max_image):
+        img = np.load(_save_once(directory, side), mmap_mode="r")
+        trans_mat = _rotation(side)
+        for mode in ("nearest", "bilinear", "bicubic"):
+            # Without the cache of remap tables every run builds its table
+            cases.append((f"warping/{mode}/{side}", lambda img=img, trans_mat=trans_mat, mode=mode:
+                          lab3.warp_affine(img, trans_mat, mode, cache=None), side * side, "pixels"))
+    return cases
+
+
+def _lsystem_cases(lab31, args) -> list:
+    cases = []
+    for name, (axiom, rules, angle, scale) in LSYSTEMS.items():
+        for depth in range(4, args.max_depth + 1, 4):
+            n_iter = depth // scale
+
+            def generate(axiom=axiom, rules=rules, angle=angle, n_iter=n_iter):
+                l_sys = lab31.LSystem2D(axiom, 2, 5, angle)
+                l_sys.add_rules(*rules)
+                l_sys.generate_path(n_iter)
+                return l_sys.segments()[0]
+
+            cases.append((f"lsystem/{name}/{n_iter}", generate, None, "segments"))
+    return cases
+
+
+def _bezier_cases(lab1, args) -> list:
+    cases = []
+    count = 10
+    while count <= args.max_points:
+        points = _random_points(count)
+
+        def uniform(points=points):
+            controls = lab1.BezierLines.calcControlPoints(points)[0]
+            return lab1.BezierLines.bezierBasis(200) @ controls
+
+        def adaptive(points=points):
+            controls = lab1.BezierLines.calcControlPoints(points)[0]
+            return np.vstack(lab1.BezierLines.flattenBezier(controls, 0.25)[0])
+
+        cases.append((f"bezier/uniform/{count}", uniform, count - 1, "segments"))
+        cases.append((f"bezier/adaptive/{count}", adaptive, count - 1, "segments"))
+        count *= 10
+    return cases
+
+
+def _sizes(smallest: int, largest: int) -> list:
+    sizes = []
+    while smallest <= largest:
+        sizes.append(smallest)
+        smallest *= 2
+    return sizes
+
+
+def _save_once(directory: str, side: int) -> str:
+    path = os.path.join(directory, f"image_{side}.npy")
+    if not os.path.exists(path):
+        np.save(path, _synthetic_image(side))
+    return path
+
+
+# Best time of repeat runs, then the peak of allocations of one more run under tracemalloc
+def _measure(run, repeat: int) -> tuple:
+    seconds = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        seconds = min(seconds, time.perf_counter() - start)
+        del result
+
+    tracemalloc.start()
+    result = run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def main(argv: list) -> int:
+    """
+
+    :param argv: command line arguments
+    :return: exit code, 1 if a check failed or a case regressed
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks of the labs")
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=GROUPS, help="groups of cases to run")
+    parser.add_argument("--max-image", type=int, default=2048, help="side of the largest image, up to 8192")
+    parser.add_argument("--max-depth", type=int, default=16, help="largest L-system depth, from 4 in steps of 4")
+    parser.add_argument("--max-points", type=int, default=10000, help="largest number of spline points")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every case, the best time is taken")
+    parser.add_argument("--baseline", default=os.path.join(ROOT, "benchmark_baseline.json"))
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative slowdown reported as a regression")
+    parser.add_argument("--trace", help="Chrome trace file of the stages of one more run of every case")
+    args = parser.parse_args(argv)
+
+    labs = {
+        "convolution": lambda: load_lab("Лаб_2_spatial_image_processing", "lab2"),
+        "warping": lambda: load_lab("Lab_3_transformation_of_rasters", "lab3"),
+        "lsystem": lambda: load_lab("Lab3.1_2d_fractals", "lab31"),
+        "bezier": lambda: load_lab("Лаб_1", "lab1"),
+    }
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["cases"]
+
+    failures = []
+    results = {}
+    profiler = Profiler(memory=False) if args.trace else None
+    with tempfile.TemporaryDirectory() as directory:
+        for group in args.only:
+            lab = labs[group]()
+            if profiler is not None and group != "bezier":
+                profiler.instrument(lab)
+            if group == "convolution":
+                checks, cases = _check_convolution(lab, directory), _convolution_cases(lab, directory, args)
+            elif group == "warping":
+                checks, cases = _check_warping(lab), _warping_cases(lab, directory, args)
+            elif group == "lsystem":
+                checks, cases = _check_lsystem(lab), _lsystem_cases(lab, args)
+            else:
+                checks, cases = _check_bezier(lab), _bezier_cases(lab, args)
+            for failure in checks:
+                print(f"FAILED: {failure}")
+            failures += checks
+
+            for name, run, work, unit in cases:
+                seconds, peak, result = _measure(run, args.repeat)
+                work = len(result) if work is None else work
+                if profiler is not None:
+                    with profiler, profiler.stage(name, work, unit):
+                        run()
+                results[name] = {"seconds": seconds, "peak_bytes": peak, "throughput": work / seconds / 1e6,
+                                 "unit": unit, "digest": _digest(result)}
+                del result
+
+                line = (f"{name:32} {seconds * 1000:10.2f} ms {peak / 2 ** 20:9.1f} MB "
+                        f"{work / seconds / 1e6:9.2f} M{unit}/s")
+                if name in baseline:
+                    previous = baseline[name]
+                    change = seconds / previous["seconds"] - 1
+                    line += f" {change:+7.1%}"
+                    # Differences below a millisecond are noise
+                    if change > args.threshold and seconds - previous["seconds"] > 1e-3:
+                        line += "  REGRESSION"
+                        failures.append(f"{name} is {change:.0%} slower than the baseline")
+                    if previous["digest"] != results[name]["digest"]:
+                        line += "  OUTPUT CHANGED"
+                        failures.append(f"{name} output differs from the baseline")
+                print(line)
+
+    if args.save:
+        with open(args.baseline, "w") as file:
+            json.dump({"machine": {"platform": platform.platform(), "processor": platform.processor(),
+                                   "cpus": os.cpu_count(), "python": platform.python_version(),
+                                   "numpy": np.__version__}, "cases": results}, file, indent=1)
+        print(f"Baseline saved to {args.baseline}")
+
+    if profiler is not None:
+        profiler.dump_chrome_trace(args.trace)
+        print(f"Trace saved to {args.trace}")
+
+    if failures:
+        print(f"{len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
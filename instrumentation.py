@@ -0,0 +1,247 @@
+"""
+Opt-in instrumentation of the labs: the raster Image classes of Лаб_2 and Lab_3 and LSystem2D of Lab3.1.
+
+A Profiler replaces the stage functions and methods of a loaded lab module with timed wrappers while it
+is active and puts the original ones back afterwards, so the labs run their own code with no overhead
+when nothing is profiled. Every call of a stage is recorded with its wall time, the bytes it allocated
+(tracemalloc, on the thread that started the profiler) and the pixels, symbols or segments it processed.
+
+    lab2 = instrumentation.load_lab("Лаб_2_spatial_image_processing")
+    with instrumentation.Profiler().instrument(lab2) as profiler:
+        lab2.Image("image.jpg").sharpen()
+    profiler.dump_chrome_trace("trace.json")    # chrome://tracing or https://ui.perfetto.dev
+    profiler.dump_json("stages.json")
+
+Stages run in worker processes (warp_affine_tiled) are not seen.
+"""
+import functools
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+# Imports main.py of a lab, the directory names are not valid module names
+def load_lab(directory: str, name=None):
+    name = name or "lab_" + "".join(char if char.isalnum() else "_" for char in directory)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, directory, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _pixels(img) -> int:
+    return img.shape[0] * img.shape[1] if img is not None else 0
+
+
+# Stages of the labs: (class name or None for the module, attribute, stage name, units, count of the units
+# from the arguments and the result of the call). A lab is recognized by the first attribute of its table
+_STAGES = {
+    "raster filters": [
+        ("Image", "_save", "filter", "pixels", lambda args, result: _pixels(args[0]._img)),
+        ("Image", "apply_filters", "apply_filters", "pixels", lambda args, result: _pixels(args[0]._img)),
+        ("Image", "stream_filter", "stream_filter", "pixels", lambda args, result: _pixels(args[0]._img)),
+        (None, "_convolve", "convolve", "pixels", lambda args, result: _pixels(args[0])),
+        (None, "_convolve_uint8", "convolve_uint8", "pixels", lambda args, result: _pixels(args[0])),
+        (None, "_accumulate", "accumulate", "pixels", lambda args, result: _pixels(args[0])),
+        (None, "_saturate", "saturate", "pixels", lambda args, result: _pixels(args[0])),
+        (None, "_correlate", "correlate", "pixels", lambda args, result: _pixels(args[0])),
+        (None, "_correlate_separable", "correlate_separable", "pixels", lambda args, result: _pixels(args[0])),
+        (None, "_correlate_fft", "correlate_fft", "pixels", lambda args, result: _pixels(args[0])),
+        (None, "_normalize", "normalize", "pixels", lambda args, result: _pixels(args[0])),
+        ("cv2", "imread", "decode", "pixels", lambda args, result: _pixels(result)),
+        ("cv2", "imwrite", "encode", "pixels", lambda args, result: _pixels(args[1])),
+    ],
+    "raster transformation": [
+        (None, "warp_affine", "warp", "pixels", lambda args, result: _pixels(result)),
+        ("Image", "bilinear_filtering", "bilinear_filtering", "pixels", lambda args, result: _pixels(result)),
+        ("Image", "simple_transform", "simple_transform", "pixels", lambda args, result: _pixels(result)),
+        ("Image", "transform", "transform", "pixels", lambda args, result: _pixels(result)),
+        (None, "warp_affine_tiled", "warp_tiled", "pixels", lambda args, result: _pixels(result)),
+        (None, "_build_remap_table", "remap_table", "pixels", lambda args, result: result.inside.size),
+        (None, "_apply_remap_table", "sample", "pixels", lambda args, result: _pixels(args[2])),
+        (None, "_pyramid_level", "pyramid", "pixels", lambda args, result: _pixels(result)),
+        (None, "_transform_file", "transform_file", "pixels", lambda args, result: result[0]),
+        ("cv2", "imdecode", "decode", "pixels", lambda args, result: _pixels(result)),
+        ("cv2", "imencode", "encode", "pixels", lambda args, result: _pixels(args[1])),
+        ("cv2", "imwrite", "encode", "pixels", lambda args, result: _pixels(args[1])),
+    ],
+    "L-system": [
+        ("LSystem2D", "generate_path", "generate", "symbols", lambda args, result: len(args[0]._codes)),
+        ("LSystem2D", "segments", "segments", "segments", lambda args, result: len(result[0])),
+        ("LSystem2D", "render", "render", "pixels", lambda args, result: _pixels(result)),
+        ("LSystem2D", "write_svg", "svg", None, None),
+        ("GeometryCache", "codes", "cache_codes", "symbols", lambda args, result: len(result)),
+        ("GeometryCache", "segments", "cache_segments", "segments", lambda args, result: len(result)),
+        (None, "_brackets", "brackets", "symbols", lambda args, result: len(args[0])),
+        ("cv2", "polylines", "polylines", "paths", lambda args, result: len(args[1])),
+        ("cv2", "imwrite", "encode", "pixels", lambda args, result: _pixels(args[1])),
+    ],
+}
+
+
+# Stands for the cv2 module in a lab module, with some of its functions replaced
+class _Cv2Proxy:
+    def __init__(self, cv2):
+        self._cv2 = cv2
+
+    def __getattr__(self, name):
+        return getattr(self._cv2, name)
+
+
+class Profiler:
+    def __init__(self, memory=True):
+        """
+
+        :param memory: measure the bytes allocated by the stages with tracemalloc, which slows Python code down
+        """
+        self.memory = memory
+        self.events = []
+        self._targets = []
+        self._patches = []
+        self._thread = None
+        self._started_tracemalloc = False
+        # Stack of the stages running on the profiling thread: start of the traced memory and peak so far
+        self._memory_stack = []
+        # Times of the events are counted from the creation of the profiler
+        self._origin = time.perf_counter_ns()
+
+    # Adds the stages of a lab module, they are wrapped while the profiler is active
+    def instrument(self, module):
+        for lab, stages in _STAGES.items():
+            owner, attribute = stages[0][:2]
+            if hasattr(getattr(module, owner, None) if owner else module, attribute):
+                self._targets.append((module, stages))
+                return self
+        raise ValueError(f"{module.__name__} is not a lab with known stages")
+
+    def start(self):
+        self._thread = threading.get_ident()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        for module, stages in self._targets:
+            for owner_name, attribute, name, unit, count in stages:
+                if owner_name == "cv2":
+                    if not isinstance(module.cv2, _Cv2Proxy):
+                        self._patch(module, "cv2", _Cv2Proxy(module.cv2))
+                    owner = module.cv2
+                    function = getattr(owner._cv2, attribute)
+                else:
+                    owner = getattr(module, owner_name, None) if owner_name else module
+                    if not hasattr(owner, attribute):
+                        continue
+                    function = getattr(owner, attribute)
+                self._patch(owner, attribute, self._wrap(function, name, unit, count))
+        return self
+
+    def stop(self):
+        for owner, attribute, original in reversed(self._patches):
+            if original is None:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, original)
+        self._patches = []
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Records a stage of code that is not a lab function: with profiler.stage("load") as record: ...
+    def stage(self, name: str, units=None, unit=None):
+        return _Stage(self, name, units, unit)
+
+    # Total time, calls, bytes and throughput of every stage
+    def summary(self) -> dict:
+        stages = {}
+        for event in self.events:
+            stage = stages.setdefault(event["name"], {"calls": 0, "seconds": 0.0, "bytes": 0, "units": 0,
+                                                      "unit": event["unit"]})
+            stage["calls"] += 1
+            stage["seconds"] += event["dur"] / 1e9
+            stage["bytes"] += event["bytes"] or 0
+            stage["units"] += event["units"] or 0
+        for stage in stages.values():
+            stage["throughput"] = stage["units"] / stage["seconds"] if stage["seconds"] and stage["unit"] else None
+        return stages
+
+    def dump_json(self, path: str):
+        with open(path, "w") as file:
+            json.dump({"summary": self.summary(), "events": self.events}, file, indent=1)
+
+    # Trace Event Format of chrome://tracing and Perfetto: complete events with times in microseconds
+    def dump_chrome_trace(self, path: str):
+        events = [{"name": event["name"], "cat": event["unit"] or "stage", "ph": "X", "pid": os.getpid(),
+                   "tid": event["tid"], "ts": event["ts"] / 1000, "dur": event["dur"] / 1000,
+                   "args": {"bytes": event["bytes"], event["unit"] or "units": event["units"],
+                            "per_second": event["per_second"]}}
+                  for event in self.events]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    def _patch(self, owner, attribute, value):
+        # A method inherited from a base class is removed again instead of being set on the subclass
+        original = owner.__dict__.get(attribute) if isinstance(owner, type) else getattr(owner, attribute)
+        self._patches.append((owner, attribute, original))
+        setattr(owner, attribute, value)
+
+    def _wrap(self, function, name: str, unit, count):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _Stage(self, name, None, unit) as record:
+                result = function(*args, **kwargs)
+                if count is not None:
+                    record.units = count(args, result)
+            return result
+
+        return wrapper
+
+
+class _Stage:
+    def __init__(self, profiler: Profiler, name: str, units, unit):
+        self.profiler = profiler
+        self.name = name
+        self.units = units
+        self.unit = unit
+
+    def __enter__(self):
+        profiler = self.profiler
+        self._measure = profiler._started_tracemalloc and threading.get_ident() == profiler._thread
+        if self._measure:
+            current, peak = tracemalloc.get_traced_memory()
+            if profiler._memory_stack:
+                profiler._memory_stack[-1][1] = max(profiler._memory_stack[-1][1], peak)
+            profiler._memory_stack.append([current, current])
+            tracemalloc.reset_peak()
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter_ns() - self._start
+        profiler = self.profiler
+        allocated = None
+        if self._measure:
+            start, peak = profiler._memory_stack.pop()
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            allocated = peak - start
+            # The peak of a nested stage is a peak of the stage around it too
+            if profiler._memory_stack:
+                profiler._memory_stack[-1][1] = max(profiler._memory_stack[-1][1], peak)
+
+        profiler.events.append({
+            "name": self.name, "ts": self._start - profiler._origin, "dur": duration,
+            "tid": threading.get_ident(), "bytes": allocated, "units": self.units, "unit": self.unit,
+            "per_second": self.units / duration * 1e9 if self.units and duration else None,
+        })
@@ -1,6 +1,8 @@
 import tkinter
 import math
 
+import numpy as np
+
 
 class BezierLines(tkinter.Frame):
 
@@ -13,8 +15,24 @@ class BezierLines(tkinter.Frame):
     def initUI(self):
         self.master.title("Кривые Безье")
         self.points = []
+        # Элементы холста точек и сегментов кривой, сегмент i идет от точки i к i + 1
+        self.point_items = []
+        self.segment_items = []
+        # Кривая нарисована и изменяется вместе с точками
+        self.drawn = False
+        self.dragged = None
+        self.animation = None
         self.brush_size = 3
         self.color = "black"
+        # Допустимое отклонение ломаной от кривой в пикселях; при None сегменты делятся на samples точек
+        self.tolerance = 0.25
+        self.samples = 200
+        self.stats = {}
+        # Статистика приближения каждого сегмента (строки flattenBezier), из нее собирается self.stats
+        self.segment_stats = []
+        # Частота кадров анимации рисования
+        self.fps = 60
+        self.animate = tkinter.BooleanVar(self, value=False)
 
         self.canvas_height = 600
         self.canvas_width = 1000
@@ -30,7 +48,17 @@ class BezierLines(tkinter.Frame):
         draw_button = tkinter.Button(self, text="Draw", command=self.drawLines)
         draw_button.pack(side=tkinter.RIGHT)
 
-        self.cnv.bind("<Button-1>", self.drawPoint)
+        animate_button = tkinter.Checkbutton(self, text="Animate", variable=self.animate)
+        animate_button.pack(side=tkinter.RIGHT, padx=5)
+
+        self.stats_label = tkinter.Label(self)
+        self.stats_label.pack(side=tkinter.LEFT, padx=5)
+
+        # Щелчок по пустому месту добавляет точку, точку можно перетащить, правая кнопка удаляет ее
+        self.cnv.bind("<Button-1>", self.onPress)
+        self.cnv.bind("<B1-Motion>", self.onDrag)
+        self.cnv.bind("<ButtonRelease-1>", self.onRelease)
+        self.cnv.bind("<Button-3>", self.onRightClick)
 
     def centerWindow(self):
         sw = self.parent.winfo_screenwidth()
@@ -42,8 +70,32 @@ class BezierLines(tkinter.Frame):
 
         self.parent.geometry('%dx%d+%d+%d' % (self.canvas_width, window_height, x, y))
 
-    def drawPoint(self, event):
+    # Индекс точки под курсором или None
+    def pointUnderCursor(self):
+        current = self.cnv.find_withtag("current")
+        if current and current[0] in self.point_items:
+            return self.point_items.index(current[0])
+        return None
+
+    def onPress(self, event):
+        self.dragged = self.pointUnderCursor()
+        if self.dragged is None:
+            self.drawPoint(event)
+
+    def onDrag(self, event):
+        if self.dragged is not None:
+            self.movePoint(self.dragged, event.x, event.y)
 
+    def onRelease(self, event):
+        self.dragged = None
+
+    def onRightClick(self, event):
+        index = self.pointUnderCursor()
+        if index is not None:
+            self.deletePoint(index)
+
+    def drawPoint(self, event):
+        self.stopAnimation()
         self.points.append((event.x, event.y))
 
         x1 = event.x - self.brush_size
@@ -51,63 +103,243 @@ class BezierLines(tkinter.Frame):
         y1 = event.y - self.brush_size
         y2 = event.y + self.brush_size
 
-        self.cnv.create_oval(x1, y1, x2, y2, fill=self.color, outline=self.color)
-
-    def drawLine(self, p1, p2, p3, p4):
-        t = 0.001
-        while t <= 1:
-            point = (self.calcBezierCoordinate(p1[0], p2[0], p3[0], p4[0], t),
-                     self.calcBezierCoordinate(p1[1], p2[1], p3[1], p4[1], t))
-            x1 = point[0] - self.brush_size + 2
-            x2 = point[0] + self.brush_size - 2
-            y1 = point[1] - self.brush_size + 2
-            y2 = point[1] + self.brush_size - 2
-
-            self.cnv.create_oval(x1, y1, x2, y2, fill=self.color, outline=self.color)
-
-            t += 0.001
-
-            self.after(1)
-            self.update()
+        self.point_items.append(self.cnv.create_oval(x1, y1, x2, y2, fill=self.color, outline=self.color,
+                                                     tags="point"))
+
+        if self.drawn and len(self.points) > 1:
+            self.segment_items.append(self.createSegment())
+            self.segment_stats.append(None)
+            self.updateSegments(len(self.points) - 3, len(self.points))
+
+    # Изменение точки k меняет только сегменты k - 2..k + 1
+    def movePoint(self, k, x, y):
+        self.stopAnimation()
+        self.points[k] = (x, y)
+        self.cnv.coords(self.point_items[k], x - self.brush_size, y - self.brush_size,
+                        x + self.brush_size, y + self.brush_size)
+        if self.drawn:
+            self.updateSegments(k - 2, k + 1)
+
+    def deletePoint(self, k):
+        self.stopAnimation()
+        del self.points[k]
+        self.cnv.delete(self.point_items.pop(k))
+        if self.drawn and self.segment_items:
+            # Сегменты k - 1 и k сливаются в один
+            removed = min(k, len(self.segment_items) - 1)
+            for item in self.segment_items.pop(removed):
+                self.cnv.delete(item)
+            del self.segment_stats[removed]
+            self.updateSegments(k - 2, k + 1)
+
+    # Элементы сегмента: кривая, отрезок между точками и построение внутренней точки в его конце
+    # (точки aj1, aj2, bj, pi1, pi2 и отрезки aj1-aj2, pi1-pi2)
+    def createSegment(self):
+        items = [self.cnv.create_line(0, 0, 0, 0, fill=self.color, width=self.brush_size - 1, tags="segment"),
+                 self.cnv.create_line(0, 0, 0, 0, fill="blue", width=self.brush_size - 2, tags="segment")]
+        for color in ("blue", "blue", "green", "purple", "purple"):
+            items.append(self.cnv.create_oval(0, 0, 0, 0, fill=color, outline=color, tags="segment"))
+        for color in ("green", "purple"):
+            items.append(self.cnv.create_line(0, 0, 0, 0, fill=color, width=self.brush_size - 2, tags="segment"))
+        self.cnv.tag_raise("point")
+        return items
+
+    # Пересчитывает сегменты first..last и обновляет их элементы на холсте. Сегмент i зависит только
+    # от точек i - 1..i + 2, поэтому опорные точки вычисляются по точкам first - 1..last + 2
+    def updateSegments(self, first, last):
+        first, last = max(first, 0), min(last, len(self.points) - 2)
+        if first > last:
+            self.showStats()
+            return []
+
+        start = max(first - 1, 0)
+        controls, helpers = self.calcControlPoints(self.points[start:last + 3])
+        curves, stats = self.calcCurves(controls[first - start:last - start + 1])
+        self.segment_stats[first:last + 1] = stats
+        self.showStats()
+
+        for i, curve in zip(range(first, last + 1), curves):
+            curve_item, chord_item, *helper_items = self.segment_items[i]
+            self.cnv.coords(curve_item, curve.ravel().tolist())
+            self.cnv.coords(chord_item, *self.points[i], *self.points[i + 1])
+
+            if i + 2 == len(self.points):
+                for item in helper_items:
+                    self.cnv.itemconfigure(item, state="hidden")
+                continue
+            aj1, aj2, bj, pi1, pi2 = (helper[i - start] for helper in helpers)
+            for item, (x, y) in zip(helper_items, (aj1, aj2, bj, pi1, pi2)):
+                self.cnv.coords(item, x - 3, y - 3, x + 3, y + 3)
+            self.cnv.coords(helper_items[5], *aj1, *aj2)
+            self.cnv.coords(helper_items[6], *pi1, *pi2)
+            for item in helper_items:
+                self.cnv.itemconfigure(item, state="normal")
+
+        return curves
+
+    # Ломаные сегментов по их опорным точкам (сегменты х 4 х 2) и статистика приближения каждого сегмента
+    def calcCurves(self, controls):
+        if self.tolerance is None:
+            # Все сегменты вычисляются сразу: матрица базиса (точки х 4) на опорные точки (сегменты х 4 х 2)
+            return list(self.bezierBasis(self.samples) @ controls), [None] * len(controls)
+        curves, stats = self.flattenBezier(controls, self.tolerance)
+        return curves, list(stats["segments"])
+
+    # Собирает self.stats из статистики сегментов и показывает ее
+    def showStats(self):
+        if not self.segment_stats or any(stats is None for stats in self.segment_stats):
+            self.stats = {}
+            self.stats_label.configure(text="")
+            return
+
+        vertices, max_errors, error_sums, depths = np.array(self.segment_stats).T
+        self.stats = {"vertices": int(vertices.sum()), "max_error": float(max_errors.max()),
+                      "mean_error": float(error_sums.sum() / (vertices - 1).sum()), "depth": int(depths.max())}
+        self.stats_label.configure(text=f"Вершин: {self.stats['vertices']}, "
+                                        f"отклонение до {self.stats['max_error']:.3f} пикс.")
+
+    # Анимация рисования: каждый кадр дорисовывает часть сегмента, целый сегмент рисуется за секунду
+    def drawCurves(self, curves, segment=0, count=0):
+        count = min(count + math.ceil(len(curves[segment]) / self.fps), len(curves[segment]))
+        self.cnv.coords(self.segment_items[segment][0], curves[segment][:max(count, 2)].ravel().tolist())
+        if count == len(curves[segment]):
+            segment, count = segment + 1, 0
+
+        self.animation = None
+        if segment < len(curves):
+            self.animation = (self.after(1000 // self.fps, self.drawCurves, curves, segment, count), curves, segment)
+
+    # Прерывает анимацию, дорисовывая оставшиеся сегменты
+    def stopAnimation(self):
+        if self.animation is None:
+            return
+        after_id, curves, segment = self.animation
+        self.after_cancel(after_id)
+        for items, curve in zip(self.segment_items[segment:], curves[segment:]):
+            self.cnv.coords(items[0], curve.ravel().tolist())
+        self.animation = None
 
     def drawLines(self):
-        next_p = self.points[0]
-        for i in range(len(self.points) - 2):  # должно быть 2
-            aj1 = ((self.points[i][0] + self.points[i + 1][0]) / 2, (self.points[i][1] + self.points[i + 1][1]) / 2)
-            aj2 = (
-            (self.points[i + 1][0] + self.points[i + 2][0]) / 2, (self.points[i + 1][1] + self.points[i + 2][1]) / 2)
-
-            lam = self.ratioOfSegments(self.points[i], self.points[i + 1], self.points[i + 2])
-            bj = ((aj1[0] + lam * aj2[0]) / (1 + lam), (aj1[1] + lam * aj2[1]) / (1 + lam))
-
-            pi1 = (aj1[0] - bj[0] + self.points[i + 1][0], aj1[1] - bj[1] + self.points[i + 1][1])
-            pi2 = (aj2[0] - bj[0] + self.points[i + 1][0], aj2[1] - bj[1] + self.points[i + 1][1])
-
-            self.drawLine(self.points[i], next_p, pi1, self.points[i + 1])
-
-            next_p = pi2
-
-            self.cnv.create_oval(aj1[0] - 3, aj1[1] - 3, aj1[0] + 3, aj1[1] + 3, fill="blue", outline="blue")
-            self.cnv.create_oval(aj2[0] - 3, aj2[1] - 3, aj2[0] + 3, aj2[1] + 3, fill="blue", outline="blue")
-            self.cnv.create_oval(bj[0] - 3, bj[1] - 3, bj[0] + 3, bj[1] + 3, fill="green", outline="green")
-            self.cnv.create_oval(pi1[0] - 3, pi1[1] - 3, pi1[0] + 3, pi1[1] + 3, fill="purple", outline="purple")
-            self.cnv.create_oval(pi2[0] - 3, pi2[1] - 3, pi2[0] + 3, pi2[1] + 3, fill="purple", outline="purple")
-
-            self.cnv.create_line(aj1, aj2, fill="green", width=self.brush_size - 2)
-            self.cnv.create_line(pi1, pi2, fill="purple", width=self.brush_size - 2)
-            self.cnv.create_line(self.points[i], self.points[i + 1], fill="blue", width=self.brush_size - 2)
-
-        self.drawLine(self.points[-2], next_p, self.points[-1], self.points[-1])
-        self.cnv.create_line(self.points[-2], self.points[-1], fill="blue", width=self.brush_size - 2)
+        self.stopAnimation()
+        self.cnv.delete("segment")
+        self.segment_items = [self.createSegment() for _ in range(len(self.points) - 1)]
+        self.segment_stats = [None] * len(self.segment_items)
+        self.drawn = True
+
+        curves = self.updateSegments(0, len(self.points) - 2)
+        if not curves:
+            return
+
+        if self.animate.get():
+            for items, curve in zip(self.segment_items, curves):
+                self.cnv.coords(items[0], *curve[0], *curve[0])
+            self.drawCurves(curves)
+
+    # Опорные точки кубических сегментов кривой через все точки points, сегмент i идет от точки i к i + 1
+    @staticmethod
+    def calcControlPoints(points):
+        """
+
+        :return: массив опорных точек (сегменты х 4 х 2) и вспомогательные точки aj1, aj2, bj, pi1, pi2
+                 для каждой внутренней точки
+        """
+        points = np.array(points, dtype=np.float64)
+
+        aj1 = (points[:-2] + points[1:-1]) / 2
+        aj2 = (points[1:-1] + points[2:]) / 2
+
+        lam = np.hypot(*(points[1:-1] - points[:-2]).T) / np.hypot(*(points[2:] - points[1:-1]).T)
+        bj = (aj1 + lam[:, None] * aj2) / (1 + lam[:, None])
+
+        pi1 = aj1 - bj + points[1:-1]
+        pi2 = aj2 - bj + points[1:-1]
+
+        # Сегмент начинается в точке i с опорной точкой pi2 предыдущей внутренней точки, у первого
+        # сегмента она совпадает с началом, у последнего вторая опорная точка совпадает с концом
+        controls = np.empty((len(points) - 1, 4, 2))
+        controls[:, 0] = points[:-1]
+        controls[:, 1] = np.vstack((points[:1], pi2))
+        controls[:, 2] = np.vstack((pi1, points[-1:]))
+        controls[:, 3] = points[1:]
+
+        return controls, (aj1, aj2, bj, pi1, pi2)
+
+    # Приближает сегменты ломаными, деля их пополам алгоритмом де Кастельжо, пока отклонение кривой от хорды
+    # больше tolerance пикселей. Делятся сразу все еще не плоские части всех сегментов.
+    # Отклонение оценивается сверху по опорным точкам: sqrt(max(ux, vx) + max(uy, vy)) / 4,
+    # где u = 3 * p1 - 2 * p0 - p3, v = 3 * p2 - p0 - 2 * p3
+    @staticmethod
+    def flattenBezier(controls, tolerance, max_depth=16):
+        """
+
+        :param controls: опорные точки сегментов (сегменты х 4 х 2)
+        :param tolerance: допустимое отклонение в пикселях
+        :param max_depth: наибольшее число делений сегмента пополам
+        :return: список массивов вершин ломаных (вершины х 2) для каждого сегмента и статистика:
+                 число вершин, наибольшая и средняя оценка отклонения частей, глубина деления и "segments" -
+                 число вершин, наибольшее и суммарное отклонение частей и глубина деления каждого сегмента
+        """
+        parts = controls
+        segments = np.arange(len(controls))
+        starts = np.zeros(len(controls))
+        done = []
+
+        for depth in range(max_depth + 1):
+            u = 3 * parts[:, 1] - 2 * parts[:, 0] - parts[:, 3]
+            v = 3 * parts[:, 2] - parts[:, 0] - 2 * parts[:, 3]
+            errors = np.sqrt(np.maximum(u ** 2, v ** 2).sum(axis=1)) / 4
+
+            flat = (errors <= tolerance) | (depth == max_depth)
+            done.append((segments[flat], starts[flat], parts[flat], errors[flat], np.full(flat.sum(), depth)))
+            parts, segments, starts = parts[~flat], segments[~flat], starts[~flat]
+            if not len(parts):
+                break
+
+            p01 = (parts[:, 0] + parts[:, 1]) / 2
+            p12 = (parts[:, 1] + parts[:, 2]) / 2
+            p23 = (parts[:, 2] + parts[:, 3]) / 2
+            p012 = (p01 + p12) / 2
+            p123 = (p12 + p23) / 2
+            middle = (p012 + p123) / 2
+            parts = np.concatenate((np.stack((parts[:, 0], p01, p012, middle), axis=1),
+                                    np.stack((middle, p123, p23, parts[:, 3]), axis=1)))
+            segments = np.concatenate((segments, segments))
+            starts = np.concatenate((starts, starts + 0.5 ** (depth + 1)))
+
+        segments, starts, parts, errors, depths = (np.concatenate(column) for column in zip(*done))
+        order = np.lexsort((starts, segments))
+        ends = parts[order, 3]
+        bounds = np.cumsum(np.bincount(segments, minlength=len(controls)))[:-1]
+
+        curves = [np.vstack((control[:1], end)) for control, end in zip(controls, np.split(ends, bounds))]
+        max_errors = np.zeros(len(controls))
+        np.maximum.at(max_errors, segments, errors)
+        max_depths = np.zeros(len(controls))
+        np.maximum.at(max_depths, segments, depths)
+        stats = {"vertices": len(ends) + len(controls), "max_error": float(errors.max(initial=0)),
+                 "mean_error": float(errors.mean()) if len(errors) else 0.0, "depth": depth,
+                 "segments": np.column_stack((np.bincount(segments, minlength=len(controls)) + 1, max_errors,
+                                              np.bincount(segments, errors, len(controls)), max_depths))}
+        return curves, stats
+
+    # Базис Безье третьей степени в samples точках t от 0 до 1
+    @staticmethod
+    def bezierBasis(samples):
+        t = np.linspace(0, 1, samples)[:, None]
+        return np.hstack(((1 - t) ** 3, 3 * t * (1 - t) ** 2, 3 * t ** 2 * (1 - t), t ** 3))
 
     def clearAll(self):
+        self.stopAnimation()
         self.cnv.delete("all")
         self.points = []
-
-    def ratioOfSegments(self, p1, p2, p3):
-        return math.hypot(p2[0] - p1[0], p2[1] - p1[1]) / math.hypot(p3[0] - p2[0], p3[1] - p2[1])
-
-    def calcBezierCoordinate(self, c1, c2, c3, c4, t):
+        self.point_items = []
+        self.segment_items = []
+        self.segment_stats = []
+        self.drawn = False
+        self.showStats()
+
+    @staticmethod
+    def calcBezierCoordinate(c1, c2, c3, c4, t):
         return t ** 3 * (c4 - 3 * c3 + 3 * c2 - c1) + t ** 2 * (3 * c1 - 6 * c2 + 3 * c3) + t * (3 * c2 - 3 * c1) + c1
 
 
@@ -1,63 +1,211 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
 
+# Cost of the FFT correlation per pixel, expressed as the side of a square core of the same direct cost.
+# Cores with more taps than FFT_CROSSOVER ** 2 are convolved through the FFT. See calibrate_fft_crossover
+FFT_CROSSOVER = 15
+# Side of the tiles the image is split into for the overlap-add FFT correlation
+FFT_TILE = 512
+
+# Types of the new images. A pixel is sum(core * window) + offset, clamped to 0 if it is negative and divided
+# by the divisor (the sum of the core if it is positive, otherwise 1). "float64" keeps the quotient as it is,
+# cv2.imwrite rounds it half to even and saturates it to 0..255 when it writes the file. "uint8" does the same
+# rounding and saturation itself and accumulates the sums of integer cores in int16 or int32, so the written
+# files are the same, but the image takes 8 times less memory
+PRECISIONS = ("float64", "uint8")
+# Number of rows the uint8 path sums at a time. The integer buffers of a strip stay in the cache,
+# and the scratch memory of a thread does not grow with the height of the image
+STRIP_ROWS = 32
+
+
 # An instance of image
 class Image:
-    # Get file data by file name and create 3 copies of image in R, G and B spectra
-    def __init__(self, img_name: str):
+    # Get file data by file name. NumPy (.npy) and raw files are not read into memory, but mapped to it
+    def __init__(self, img_name: str, workers=None, shape=None, precision="float64"):
         """
 
-        :param img_name: file name in format: "name.jpg(jpeg, png, ...)"
+        :param img_name: file name in format: "name.jpg(jpeg, png, npy, ...)" or the name of a raw BGR file
+        :param workers: number of threads the filters run on, by default the number of processors
+        :param shape: height and width of the image in the raw file
+        :param precision: type of the new images, one of PRECISIONS
         """
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, not {precision!r}")
         self._name = img_name
-        self._img = cv2.imread(self._name)
+        self._workers = workers or os.cpu_count() or 1
+        self._precision = precision
+        # New image of the uint8 precision, reused by the next filters with a core of the same size,
+        # and the scratch buffers of the strips of the uint8 path
+        self._new_img = None
+        self._scratch = _ScratchPool()
+        if shape is not None:
+            self._format = "raw"
+            self._img = np.memmap(self._name, np.uint8, "r", shape=(shape[0], shape[1], 3))
+        elif self._name.endswith(".npy"):
+            self._format = "npy"
+            self._img = np.load(self._name, mmap_mode="r")
+        else:
+            self._format = "image"
+            self._img = cv2.imread(self._name)
         self._height = self._img.shape[0]
         self._width = self._img.shape[1]
-        self._b, self._g, self._r = cv2.split(self._img)
 
     # Create an RGB-copy with blur effect of original image
-    def blur(self):
+    def blur(self, size=3):
+        """
+
+        :param size: side of the square averaging core
+        """
         # Задание матрицы ядра свертки
-        convolution_core = np.array(([1, 1, 1], [1, 1, 1], [1, 1, 1]))
+        self._save(Filter('blured_', np.ones((size, size), int)))
 
-        new_merge_img = self._convolution_rgb(convolution_core)
-        cv2.imwrite(f'blured_{self._name}', new_merge_img)
+    # Create an RGB-copy with gaussian blur effect of original image
+    def gaussian_blur(self, size=5, sigma=None):
+        """
+
+        :param size: side of the square gaussian core
+        :param sigma: standard deviation of the gaussian, by default it is derived from the size
+        """
+        self._save(Filter('gaussian_blured_', gaussian_core(size, sigma)))
 
     # Create an RGB-copy with sharpen effect of original image
     def sharpen(self):
-        convolution_core = np.array(([-1, -1, -1], [-1, 9, -1], [-1, -1, -1]))
-
-        new_merge_img = self._convolution_rgb(convolution_core)
-        cv2.imwrite(f'sharpened_{self._name}', new_merge_img)
+        self._save(FILTERS["sharpen"])
 
     # Create an RGB-copy with edge_detection effect of original image
     def edge_detection(self):
-        convolution_core = np.array(([0, 4, 0], [4, -16, 4], [0, 4, 0]))
-
-        new_merge_img = self._convolution_rgb(convolution_core)
-        cv2.imwrite(f'edge_detected_{self._name}', new_merge_img)
+        self._save(FILTERS["edge_detection"])
 
     # Create an RGB-copy with sobel_y_edge_detection effect of original image
-    def sobel_edge_detection_y(self):
-        convolution_core = np.array(([-1, 0, 1], [-2, 0, 2], [-1, 0, 1]))
+    def sobel_edge_detection_y(self, size=3):
+        """
 
-        new_merge_img = self._convolution_rgb(convolution_core)
-        cv2.imwrite(f'sobel_edge_detected_y_{self._name}', new_merge_img)
+        :param size: side of the sobel core: 3, 5, 7, ...
+        """
+        self._save(Filter('sobel_edge_detected_y_', sobel_core(size)))
 
     def negative(self):
-        convolution_core = np.array(([0, 0, 0], [0, -1, 0], [0, 0, 0]))
-
-        new_merge_img = self._convolution_rgb(convolution_core, 255)
-        cv2.imwrite(f'negative_{self._name}', new_merge_img)
+        self._save(FILTERS["negative"])
 
     def emboss(self):
-        convolution_core = np.array(([-2, -1, 0], [-1, 0, 1], [0, 1, 2]))
+        self._save(FILTERS["emboss"])
+
+    # Create RGB-copies with several effects of original image in one run. Chained filters whose intermediate
+    # result is never clamped are fused into one core, so the image is walked once per output
+    def apply_filters(self, *filters, write=True) -> dict:
+        """
+
+        :param filters: names from FILTERS, Filter objects or lists of them, which are applied one after another
+        :param write: write the new images to files
+        :return: dictionary "file name: processed RGB-image"
+        """
+        new_imgs = {}
+        # Results of the chains, the later chains may continue one of them
+        done = {}
+        for chain in filters:
+            if isinstance(chain, (str, Filter)):
+                chain = [chain]
+            chain = [FILTERS[flt] if isinstance(flt, str) else flt for flt in chain]
+            stages = _fuse(chain)
 
-        new_merge_img = self._convolution_rgb(convolution_core, 128)
-        cv2.imwrite(f'emboss_{self._name}', new_merge_img)
+            # The longest already computed beginning of the chain is reused
+            start = max((i for i in range(1, len(stages) + 1) if tuple(stages[:i]) in done), default=0)
+            new_img = done[tuple(stages[:start])] if start else self._img
+            for i in range(start, len(stages)):
+                flt = stages[i]
+                new_img = _convolve(new_img, flt.core, flt.offset, workers=self._workers, divisor=flt.divisor)
+                done[tuple(stages[:i + 1])] = new_img
 
-    # Performs a convolution according to the core of AHSL-image
+            name = ''.join(flt.prefix for flt in reversed(chain)) + self._name
+            if write:
+                self._write(name, new_img)
+            new_imgs[name] = new_img
+
+        return new_imgs
+
+    # Writes the RGB-copy of original image with the effect of the filter to a NumPy file strip by strip.
+    # Only a strip of the source and of the result is kept in memory, however large the image is
+    def stream_filter(self, flt, destination: str, band_rows=256, dtype=np.uint8) -> np.ndarray:
+        """
+
+        :param flt: name from FILTERS or Filter
+        :param destination: name of the .npy file to write
+        :param band_rows: number of rows of the result in a strip
+        :param dtype: type of the written pixels. Pixels are rounded and saturated for integer types, as cv2.imwrite does
+        :return: new image mapped to memory
+        """
+        if isinstance(flt, str):
+            flt = FILTERS[flt]
+        core_height, core_width = flt.core.shape
+
+        new_img = np.lib.format.open_memmap(destination, "w+", dtype,
+                                            (self._height - core_height + 1, self._width - core_width + 1, 3))
+        new_img[-1] = 0
+        new_img[:, -1] = 0
+
+        # As in _convolve, the last row and column of the source are not used
+        img = self._img[:-1, :-1]
+        method = _choose_method(flt.core, img.shape)
+        strip = np.empty((band_rows, new_img.shape[1] - 1, 3)) if np.dtype(dtype) != np.uint8 else None
+        for top in range(0, new_img.shape[0] - 1, band_rows):
+            bottom = min(top + band_rows, new_img.shape[0] - 1)
+            if np.dtype(dtype) == np.uint8:
+                # Integer cores are summed in integers and the pixels are written to the file directly
+                _convolve_uint8_into(new_img[top:bottom, :-1], img[top:bottom + core_height - 1], flt.core,
+                                     flt.offset, method, self._workers, flt.divisor, self._scratch)
+                new_img.flush()
+                continue
+
+            _convolve_into(strip[:bottom - top], img[top:bottom + core_height - 1], flt.core, flt.offset, method,
+                           self._workers, flt.divisor)
+            if np.issubdtype(dtype, np.integer):
+                limits = np.iinfo(dtype)
+                np.clip(np.rint(strip[:bottom - top]), limits.min, limits.max, out=strip[:bottom - top])
+            new_img[top:bottom, :-1] = strip[:bottom - top]
+            new_img.flush()
+
+        return new_img
+
+    # Writes the RGB-copy of original image with the effect of the filter
+    def _save(self, flt):
+        """
+
+        :param flt: Filter
+        """
+        new_merge_img = self._convolution_rgb(flt.core, flt.offset, out=self._destination(flt.core.shape))
+        self._write(f'{flt.prefix}{self._name}', new_merge_img)
+
+    # Writes a new image in the format of original image. NumPy and raw files get uint8 pixels rounded
+    # and saturated as cv2.imwrite does, a raw file is written without a header like the source
+    def _write(self, name: str, new_img: np.ndarray):
+        if self._format == "image":
+            cv2.imwrite(name, new_img)
+            return
+
+        if new_img.dtype != np.uint8:
+            new_img = np.clip(np.rint(new_img), 0, 255).astype(np.uint8)
+        if self._format == "npy":
+            np.save(name, new_img)
+        else:
+            new_img.tofile(name)
+
+    # Preallocated new image of the uint8 precision for a core of the shape, None for the float64 one
+    def _destination(self, core_shape: tuple):
+        if self._precision != "uint8":
+            return None
+        shape = (self._height - core_shape[0] + 1, self._width - core_shape[1] + 1, 3)
+        if self._new_img is None or self._new_img.shape != shape:
+            self._new_img = np.empty(shape, np.uint8)
+        return self._new_img
+
+    # Reference per-pixel convolution of one plane (self._img[..., i]) with a 3x3 core.
+    # The vectorized _convolution_rgb must reproduce its output
     def _convolution_ahsl(self, core: np.ndarray, img: np.ndarray, new_img: np.ndarray, offset: int):
         """
 
@@ -78,24 +226,568 @@ class Image:
                     new_img[y - 1, x - 1] = data / core_sum if core_sum > 0 else data
 
     # Performs a convolution according to the core of RGB-image
-    def _convolution_rgb(self, core: np.ndarray, offset=0) -> np.ndarray:
+    def _convolution_rgb(self, core: np.ndarray, offset=0, method="auto", out=None) -> np.ndarray:
         """
 
-        :param core: matrix for convolution
+        :param core: matrix for convolution of any size N x M
+        :param method: "direct", "separable", "fft" or "auto" to choose the cheapest one for the core and the image
+        :param out: array (H - N + 1) x (W - M + 1) x 3 of the type of the precision for the result
         :return: processed RGB-image
         """
-        # Длина и ширина нового изображения меньше исходного на 2, потому что первый ряд
-        # и первый столбец, последний ряд и последний столбец не могут быть свернуты
-        new_img_r = np.zeros((self._height - 2, self._width - 2))
-        new_img_g = np.zeros((self._height - 2, self._width - 2))
-        new_img_b = np.zeros((self._height - 2, self._width - 2))
+        if self._precision == "uint8":
+            return _convolve_uint8(self._img, core, offset, method, self._workers, out=out, scratch=self._scratch)
+        return _convolve(self._img, core, offset, method, self._workers, out=out)
+
+
+# Filter of an image: the convolution core, the value added to the sums and the prefix of the new file name
+class Filter:
+    def __init__(self, prefix: str, core: np.ndarray, offset=0, divisor=None):
+        """
+
+        :param prefix: prefix of the name of the file with the filtered image
+        :param core: convolution matrix
+        :param offset: value added to every sum
+        :param divisor: value the non-negative sums are divided by, the sum of the core if it is positive by default
+        """
+        self.prefix = prefix
+        self.core = core
+        self.offset = offset
+        core_sum = core.sum()
+        self.divisor = divisor if divisor is not None else (core_sum if core_sum > 0 else 1)
+
+
+FILTERS = {
+    "blur": Filter('blured_', np.ones((3, 3), int)),
+    "sharpen": Filter('sharpened_', np.array(([-1, -1, -1], [-1, 9, -1], [-1, -1, -1]))),
+    "edge_detection": Filter('edge_detected_', np.array(([0, 4, 0], [4, -16, 4], [0, 4, 0]))),
+    "sobel_edge_detection_y": Filter('sobel_edge_detected_y_', np.array(([-1, 0, 1], [-2, 0, 2], [-1, 0, 1]))),
+    "negative": Filter('negative_', np.array(([0, 0, 0], [0, -1, 0], [0, 0, 0])), 255),
+    "emboss": Filter('emboss_', np.array(([-2, -1, 0], [-1, 0, 1], [0, 1, 2])), 128),
+}
+
+
+# Fuses the neighbouring filters of a chain into one, while the result of the first one is never negative:
+# then it is not clamped, and the two convolutions are one convolution with the composite core
+def _fuse(chain: list) -> list:
+    """
+
+    :param chain: list of Filter objects, which are applied one after another
+    :return: list of Filter objects with the same result
+    """
+    stages = [chain[0]]
+    for flt in chain[1:]:
+        first = stages[-1]
+        if (first.core >= 0).all() and first.offset >= 0:
+            # second(first(img)) = max(0, second.core * (first.core * img + first.offset) / first.divisor
+            #                             + second.offset) / second.divisor
+            stages[-1] = Filter(first.prefix + flt.prefix, _compose(first.core, flt.core),
+                                first.offset * flt.core.sum() + flt.offset * first.divisor,
+                                first.divisor * flt.divisor)
+        else:
+            stages.append(flt)
+
+    return stages
+
+
+# Creates the core whose correlation is the same as the correlation with the first core and then with the second one
+def _compose(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """
+
+    :param first: convolution matrix applied first
+    :param second: convolution matrix applied second
+    :return: matrix of the size (N1 + N2 - 1) x (M1 + M2 - 1)
+    """
+    core = np.zeros((first.shape[0] + second.shape[0] - 1, first.shape[1] + second.shape[1] - 1),
+                    np.result_type(first, second))
+    for i in range(second.shape[0]):
+        for j in range(second.shape[1]):
+            core[i:i + first.shape[0], j:j + first.shape[1]] += second[i, j] * first
+
+    return core
+
+
+# Performs a convolution of RGB-image according to the core
+def _convolve(img: np.ndarray, core: np.ndarray, offset=0, method="auto", workers=1, divisor=None,
+              out=None) -> np.ndarray:
+    """
+
+    :param img: image pixel matrix H x W x 3
+    :param core: matrix for convolution of any size N x M
+    :param offset: value added to every sum
+    :param method: "direct", "separable", "fft" or "auto" to choose the cheapest one for the core and the image
+    :param workers: number of threads
+    :param divisor: value the non-negative sums are divided by, the sum of the core by default
+    :param out: float64 array (H - N + 1) x (W - M + 1) x 3 for the result
+    :return: processed RGB-image
+    """
+    if divisor is None:
+        divisor = core.sum()
+
+    # Длина и ширина нового изображения меньше исходного на N - 1 и M - 1, потому что крайние ряды
+    # и столбцы, до которых ядро не помещается целиком, не могут быть свернуты
+    new_img = _new_image(img, core, np.float64, out)
+
+    # As in the per-pixel loop, the last row and column of the source are not used,
+    # so the last row and column of the new image stay zero
+    _convolve_into(new_img[:-1, :-1], img[:-1, :-1], core, offset, method, workers, divisor)
+
+    return new_img
+
+
+# Performs a convolution of an image into a uint8 image: the pixels are rounded half to even and saturated,
+# as cv2.imwrite does with the result of _convolve
+def _convolve_uint8(img: np.ndarray, core: np.ndarray, offset=0, method="auto", workers=1, divisor=None,
+                    out=None, scratch=None) -> np.ndarray:
+    """
+
+    :param img: image pixel matrix H x W x 3
+    :param core: matrix for convolution of any size N x M
+    :param offset: value added to every sum
+    :param method: "direct", "separable", "fft" or "auto"
+    :param workers: number of threads
+    :param divisor: value the non-negative sums are divided by, the sum of the core by default
+    :param out: uint8 array (H - N + 1) x (W - M + 1) x 3 for the result
+    :param scratch: _ScratchPool to take the scratch buffers from, by default they are freed after the call
+    :return: processed RGB-image
+    """
+    if divisor is None:
+        divisor = core.sum()
+
+    new_img = _new_image(img, core, np.uint8, out)
+    _convolve_uint8_into(new_img[:-1, :-1], img[:-1, :-1], core, offset, method, workers, divisor, scratch)
+
+    return new_img
+
+
+# New image for the convolution: the given array or a new one. Its last row and column are zero, see _convolve
+def _new_image(img: np.ndarray, core: np.ndarray, dtype, out=None) -> np.ndarray:
+    shape = (img.shape[0] - core.shape[0] + 1, img.shape[1] - core.shape[1] + 1, 3)
+    if out is None:
+        return np.zeros(shape, dtype)
+    if out.shape != shape or out.dtype != dtype:
+        raise ValueError(f"out must be a {np.dtype(dtype)} array of the shape {shape}")
+    out[-1] = 0
+    out[:, -1] = 0
+    return out
+
+
+# Performs a convolution of an image and writes the pixels, where the core fits into the image entirely, to new_img
+def _convolve_into(new_img: np.ndarray, img: np.ndarray, core: np.ndarray, offset, method, workers, divisor):
+    """
+
+    :param new_img: pixel matrix (H - N + 1) x (W - M + 1) x 3 for the result
+    :param img: image pixel matrix H x W x 3
+    :param core: matrix for convolution of any size N x M
+    :param offset: value added to every sum
+    :param method: "direct", "separable", "fft" or "auto"
+    :param workers: number of threads
+    :param divisor: value the non-negative sums are divided by
+    """
+    if method == "auto":
+        method = _choose_method(core, img.shape)
+
+    if method == "fft":
+        new_img[:] = _normalize(_correlate_fft(img, core, workers=workers), divisor, offset)
+        return
+
+    factors = _separate(core) if method == "separable" else None
+
+    # Every band of rows of the new image is computed from its own rows of the source plus the halo
+    # of core height - 1 rows below them. The bands do not depend on each other
+    def process_band(top: int, bottom: int):
+        band = img[top:bottom + core.shape[0] - 1]
+        data = _correlate(band, core) if factors is None else _correlate_separable(band, *factors)
+        new_img[top:bottom] = _normalize(data, divisor, offset)
+
+    _process_bands(process_band, new_img.shape[0], workers)
+
+
+# Performs a convolution of a uint8 image and writes the pixels rounded and saturated to the uint8 new_img.
+# The sums of an integer core are accumulated in the smallest integer type that cannot overflow: int16 for
+# the usual 3x3 and 5x5 cores. Other cores, and the ones the FFT is cheaper for, go through _convolve_into
+def _convolve_uint8_into(new_img: np.ndarray, img: np.ndarray, core: np.ndarray, offset, method, workers, divisor,
+                         scratch=None):
+    """
+
+    :param new_img: uint8 pixel matrix (H - N + 1) x (W - M + 1) x 3 for the result
+    :param img: image pixel matrix H x W x 3
+    :param core: matrix for convolution of any size N x M
+    :param offset: value added to every sum
+    :param method: "direct", "separable", "fft" or "auto"
+    :param workers: number of threads
+    :param divisor: value the non-negative sums are divided by, no division if it is not positive
+    :param scratch: _ScratchPool to take the scratch buffers from, by default they are freed after the call
+    """
+    if method == "auto":
+        method = _choose_method(core, img.shape)
+    factors = _separate(core) if method == "separable" else None
+    sum_type = _integer_sum_type(img, core, offset, divisor, factors) if method != "fft" else None
+
+    if sum_type is None:
+        data = np.empty(new_img.shape)
+        _convolve_into(data, img, core, offset, method, workers, divisor)
+        np.clip(np.rint(data, out=data), 0, 255, out=data)
+        new_img[:] = data
+        return
+
+    divisor = int(divisor) if divisor > 0 else 1
+    scratch = scratch if scratch is not None else _ScratchPool()
+
+    def process_band(top: int, bottom: int):
+        buffers = scratch.take()
+        try:
+            for strip_top in range(top, bottom, STRIP_ROWS):
+                strip_bottom = min(strip_top + STRIP_ROWS, bottom)
+                strip = img[strip_top:strip_bottom + core.shape[0] - 1]
+                data = _buffer(buffers, "data", (strip_bottom - strip_top,) + new_img.shape[1:], sum_type)
+                term = _buffer(buffers, "term", data.shape, sum_type)
+                if factors is None:
+                    _accumulate(data, strip, core, offset, term)
+                else:
+                    # The sums along the rows are the image of the second pass along the columns
+                    column, row = factors
+                    rows = _buffer(buffers, "rows", (strip.shape[0],) + new_img.shape[1:], sum_type)
+                    _accumulate(rows, strip, row[np.newaxis, :], 0,
+                                _buffer(buffers, "rows_term", rows.shape, sum_type))
+                    _accumulate(data, rows, column[:, np.newaxis], offset, term)
+                _saturate(data, divisor, term, new_img[strip_top:strip_bottom])
+        finally:
+            scratch.give(buffers)
+
+    _process_bands(process_band, new_img.shape[0], workers)
+
+
+# Smallest integer type, in which sums of the core, the offset and the rounding can not overflow,
+# or None if the uint8 path does not apply
+def _integer_sum_type(img: np.ndarray, core: np.ndarray, offset, divisor, factors):
+    if img.dtype != np.uint8 or not np.issubdtype(core.dtype, np.integer) or int(offset) != offset:
+        return None
+    if divisor > 0 and int(divisor) != divisor:
+        return None
+
+    # The largest absolute sum of the core over pixels 0..255, for a separable core also after the first pass
+    bound = int(np.abs(core).sum()) if factors is None else int(np.abs(factors[0]).sum() * np.abs(factors[1]).sum())
+    bound = bound * 255 + abs(int(offset)) + 2 * max(int(divisor), 1)
+    for sum_type in (np.int16, np.int32):
+        if bound <= np.iinfo(sum_type).max:
+            return sum_type
+    return None
+
+
+# Adds the offset and the products of the core and the image shifted under it to data
+def _accumulate(data: np.ndarray, img: np.ndarray, core: np.ndarray, offset, term: np.ndarray):
+    height, width = data.shape[:2]
+    data[...] = offset
+    for i in range(core.shape[0]):
+        for j in range(core.shape[1]):
+            coefficient = int(core[i, j])
+            window = img[i:i + height, j:j + width]
+            if coefficient == 1:
+                np.add(data, window, out=data)
+            elif coefficient == -1:
+                np.subtract(data, window, out=data)
+            elif coefficient != 0:
+                # The product is computed in the type of the sums, not in the type of the image
+                np.multiply(window, coefficient, out=term, dtype=data.dtype)
+                np.add(data, term, out=data)
+
+
+# Turns the integer sums into uint8 pixels in place: negative sums are clamped to 0, the rest are divided by
+# the divisor, rounded half to even as np.rint and cv2.imwrite round, and saturated to 255
+def _saturate(data: np.ndarray, divisor: int, remainder: np.ndarray, new_img: np.ndarray):
+    np.maximum(data, 0, out=data)
+    if divisor > 1:
+        np.divmod(data, divisor, out=(data, remainder))
+        np.left_shift(remainder, 1, out=remainder)
+        round_up = remainder > divisor
+        if divisor % 2 == 0:
+            round_up |= (remainder == divisor) & (data % 2 == 1)
+        np.add(data, round_up, out=data)
+    np.minimum(data, 255, out=data)
+    np.copyto(new_img, data, casting="unsafe")
+
+
+# Sets of scratch buffers of the uint8 path, one for every band running at the same time. A band takes a set
+# for the time it runs, so the bands running in parallel never share a buffer. An Image keeps its pool,
+# so its next filters reuse the buffers, which hold a few strips of rows per thread
+class _ScratchPool:
+    def __init__(self):
+        self._free = []
+        self._lock = threading.Lock()
+
+    def take(self) -> dict:
+        with self._lock:
+            return self._free.pop() if self._free else {}
+
+    def give(self, buffers: dict):
+        with self._lock:
+            self._free.append(buffers)
+
+
+# Buffer of the shape and the type from the set, it grows when a larger one is needed
+def _buffer(buffers: dict, name: str, shape: tuple, dtype) -> np.ndarray:
+    size = int(np.prod(shape))
+    key = (name, np.dtype(dtype))
+    if key not in buffers or buffers[key].size < size:
+        buffers[key] = np.empty(size, dtype)
+    return buffers[key][:size].reshape(shape)
+
+
+# Sums the products of the core and the image shifted under it, for all channels at once
+def _correlate(img: np.ndarray, core: np.ndarray) -> np.ndarray:
+    """
+
+    :param img: image pixel matrix H x W x C
+    :param core: convolution matrix
+    :return: matrix of sums for every position where the core fits into the image entirely
+    """
+    height = img.shape[0] - core.shape[0] + 1
+    width = img.shape[1] - core.shape[1] + 1
+    data = np.zeros((height, width) + img.shape[2:], np.result_type(core, img))
+    term = np.empty_like(data)
+
+    # The terms are added in the same order as in the per-pixel loop, so the sums are bit for bit the same.
+    # Zero coefficients are skipped: adding an exact zero does not change the sum
+    for i in range(core.shape[0]):
+        for j in range(core.shape[1]):
+            if core[i, j] != 0:
+                np.multiply(core[i, j], img[i:i + height, j:j + width], out=term)
+                data += term
+
+    return data
+
+
+# Performs the correlation with a separable core as two 1-D passes: along the rows and then along the columns
+def _correlate_separable(img: np.ndarray, column: np.ndarray, row: np.ndarray) -> np.ndarray:
+    """
+
+    :param img: image pixel matrix H x W x C
+    :param column: column vector of the core
+    :param row: row vector of the core
+    :return: the same matrix of sums as _correlate returns for the core np.outer(column, row)
+    """
+    return _correlate(_correlate(img, row[np.newaxis, :]), column[:, np.newaxis])
+
+
+# Splits the rows into a band per worker and processes the bands on a pool of threads.
+# NumPy releases the GIL in the arithmetic on arrays, so the bands are processed in parallel
+def _process_bands(process_band, rows: int, workers: int):
+    """
+
+    :param process_band: function of the first and the next after the last row of a band
+    :param rows: number of rows
+    :param workers: number of threads
+    """
+    workers = max(1, min(workers, rows))
+    if workers == 1:
+        process_band(0, rows)
+        return
+
+    bounds = np.linspace(0, rows, workers + 1).astype(int)
+    with ThreadPoolExecutor(workers) as executor:
+        # list() re-raises the exceptions of the bands
+        list(executor.map(process_band, bounds[:-1], bounds[1:]))
+
+
+# Performs the correlation through the FFT: the image is split into tiles, every tile is convolved with the flipped core
+# and the overlapping results of the neighbouring tiles are added up (overlap-add)
+def _correlate_fft(img: np.ndarray, core: np.ndarray, tile=None, workers=1) -> np.ndarray:
+    """
+
+    :param img: image pixel matrix H x W x C
+    :param core: convolution matrix
+    :param tile: side of the tiles, FFT_TILE by default
+    :param workers: number of threads the tiles of a row are transformed on
+    :return: the same matrix of sums as _correlate returns. For an integer core the sums are rounded, so they are exact
+    """
+    core_height, core_width = core.shape
+    height = img.shape[0] - core_height + 1
+    width = img.shape[1] - core_width + 1
+    tile_height, tile_width, fft_height, fft_width = _fft_tile_shape(core.shape, img.shape, tile)
+
+    core_spectrum = np.fft.rfft2(core[::-1, ::-1], (fft_height, fft_width))
+    if img.ndim == 3:
+        core_spectrum = core_spectrum[..., np.newaxis]
+
+    def convolve_tile(y: int, x: int) -> np.ndarray:
+        block = img[y:y + tile_height, x:x + tile_width]
+        spectrum = np.fft.rfft2(block, (fft_height, fft_width), axes=(0, 1))
+        return np.fft.irfft2(spectrum * core_spectrum, (fft_height, fft_width), axes=(0, 1))
+
+    # Only the part of the full convolution where the core fits into the image entirely is accumulated.
+    # The tiles are transformed in parallel, but added up in the same order for any number of workers,
+    # so the result does not depend on it
+    data = np.zeros((height, width) + img.shape[2:])
+    with ThreadPoolExecutor(max(1, workers)) as executor:
+        for y in range(0, img.shape[0], tile_height):
+            columns = range(0, img.shape[1], tile_width)
+            for x, block_data in zip(columns, executor.map(convolve_tile, [y] * len(columns), columns)):
+                block = img[y:y + tile_height, x:x + tile_width]
+
+                # The full convolution of the tile covers the rows y .. y + block_height + core_height - 2 of the full
+                # convolution of the image, whose valid rows start from core_height - 1
+                top = max(y, core_height - 1)
+                bottom = min(y + block.shape[0] + core_height - 1, img.shape[0])
+                left = max(x, core_width - 1)
+                right = min(x + block.shape[1] + core_width - 1, img.shape[1])
+                if top < bottom and left < right:
+                    data[top - core_height + 1:bottom - core_height + 1, left - core_width + 1:right - core_width + 1] += \
+                        block_data[top - y:bottom - y, left - x:right - x]
+
+    result_type = np.result_type(core, img)
+    if np.issubdtype(result_type, np.integer):
+        return np.rint(data).astype(result_type)
+    return data
+
+
+# Chooses the tile of the FFT correlation and the size of its transform
+def _fft_tile_shape(core_shape: tuple, img_shape: tuple, tile=None) -> tuple:
+    """
+
+    :param core_shape: shape of the convolution matrix
+    :param img_shape: shape of the image pixel matrix
+    :param tile: side of the tiles, FFT_TILE by default
+    :return: tile height, tile width and the height and width of the transform
+    """
+    tile = tile or FFT_TILE
+    tile_height = min(tile, img_shape[0])
+    tile_width = min(tile, img_shape[1])
+
+    return (tile_height, tile_width,
+            cv2.getOptimalDFTSize(tile_height + core_shape[0] - 1), cv2.getOptimalDFTSize(tile_width + core_shape[1] - 1))
+
+
+# Chooses the cheapest way of the correlation. The costs are counted in multiplications per pixel
+def _choose_method(core: np.ndarray, img_shape: tuple) -> str:
+    """
+
+    :param core: convolution matrix
+    :param img_shape: shape of the image pixel matrix
+    :return: "direct", "separable" or "fft"
+    """
+    costs = {"direct": core.size}
+    if _separate(core) is not None:
+        costs["separable"] = core.shape[0] + core.shape[1]
+
+    # The transform of a tile costs the same for any core, but a larger core needs a larger padding of the tile
+    tile_height, tile_width, fft_height, fft_width = _fft_tile_shape(core.shape, img_shape)
+    costs["fft"] = FFT_CROSSOVER ** 2 * fft_height * fft_width / (tile_height * tile_width)
+
+    return min(costs, key=costs.get)
+
+
+# Measures the direct and the FFT correlation on a random image and sets FFT_CROSSOVER for this machine
+def calibrate_fft_crossover(img_shape=(512, 512), size=15, repeat=3) -> int:
+    """
+
+    :param img_shape: height and width of the test image
+    :param size: side of the test core
+    :param repeat: number of measurements, the best one is taken
+    :return: new value of FFT_CROSSOVER
+    """
+    global FFT_CROSSOVER
+
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, tuple(img_shape) + (3,), np.uint8)
+    core = rng.integers(-8, 9, (size, size))
+
+    timings = []
+    for correlate in (_correlate, _correlate_fft):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            correlate(img, core)
+            best = min(best, time.perf_counter() - start)
+        timings.append(best)
+
+    tile_height, tile_width, fft_height, fft_width = _fft_tile_shape(core.shape, img.shape)
+    padding = fft_height * fft_width / (tile_height * tile_width)
+    FFT_CROSSOVER = max(1, round(float(np.sqrt(core.size * timings[1] / timings[0] / padding))))
+
+    return FFT_CROSSOVER
+
+
+# Splits a core of rank 1 into a column and a row vector, so that core == np.outer(column, row)
+def _separate(core: np.ndarray):
+    """
+
+    :param core: convolution matrix
+    :return: tuple (column, row) or None if the core is not separable
+    """
+    # A single row or column is convolved in one pass anyway
+    if 1 in core.shape:
+        return None
+
+    singular_values = np.linalg.svd(core, compute_uv=False)
+    if singular_values[1] > singular_values[0] * 1e-9:
+        return None
+
+    # Every row of a rank 1 core is a multiple of its largest row
+    i, j = np.unravel_index(np.abs(core).argmax(), core.shape)
+    if np.issubdtype(core.dtype, np.integer):
+        # For an integer core both vectors are kept integer, so both passes are exact: the row is divided by the gcd
+        # of its elements, which makes every element of the column an integer too
+        row = core[i] // np.gcd.reduce(core[i])
+        column = core[:, j] // row[j]
+        if not np.array_equal(np.outer(column, row), core):
+            return None
+    else:
+        row = core[i] / core[i, j]
+        column = core[:, j].copy()
+
+    return column, row
+
+
+# Creates a normalized square core of the gaussian blur
+def gaussian_core(size: int, sigma=None) -> np.ndarray:
+    """
+
+    :param size: side of the core, an odd number
+    :param sigma: standard deviation, the same default as in OpenCV is used if it is not specified
+    :return: float matrix size x size, the sum of its elements is 1
+    """
+    if sigma is None:
+        sigma = 0.3 * ((size - 1) * 0.5 - 1) + 0.8
+
+    x = np.arange(size) - (size - 1) / 2
+    vector = np.exp(-x ** 2 / (2 * sigma ** 2))
+    vector /= vector.sum()
+
+    return np.outer(vector, vector)
+
+
+# Creates a square sobel core of the derivative along the rows, smoothed along the columns
+def sobel_core(size: int) -> np.ndarray:
+    """
+
+    :param size: side of the core, an odd number not less than 3
+    :return: integer matrix size x size, for size 3 it is ([-1, 0, 1], [-2, 0, 2], [-1, 0, 1])
+    """
+    # Binomial coefficients of the order size - 1 and the difference of the binomial ones of the order size - 3
+    smoothing = np.array([1])
+    for _ in range(size - 1):
+        smoothing = np.convolve(smoothing, [1, 1])
+    derivative = np.array([-1, 0, 1])
+    for _ in range(size - 3):
+        derivative = np.convolve(derivative, [1, 1])
+
+    return np.outer(smoothing, derivative)
+
+
+# Turns the sums into pixel values: negative ones are clamped to 0, the rest are divided by the positive core sum
+def _normalize(data: np.ndarray, core_sum, offset) -> np.ndarray:
+    """
 
-        # Осуществление свертки для каждого спектра
-        self._convolution_ahsl(core, self._r, new_img_r, offset)
-        self._convolution_ahsl(core, self._g, new_img_g, offset)
-        self._convolution_ahsl(core, self._b, new_img_b, offset)
+    :param data: matrix of sums returned by _correlate
+    :param core_sum: sum of the core elements
+    :param offset: value added to every sum before clamping
+    :return: float64 pixel matrix
+    """
+    data += offset
+    new_img = data / core_sum if core_sum > 0 else data.astype(np.float64)
+    new_img[data < 0] = 0
 
-        return cv2.merge([new_img_b, new_img_g, new_img_r])
+    return new_img
 
 
 if __name__ == "__main__":